@@ -0,0 +1,138 @@
+"""
+Benchmark de l'encodage OSC du pont WS → OSC.
+
+Compare, en messages OSC par seconde :
+- "legacy"   : le chemin historique (f-string + sanitize_id + SimpleUDPClient.send_message)
+- "messages" : OscFrameEncoder, un datagramme par capteur
+- "bundles"  : OscFrameEncoder, un bundle (un datagramme) par trame
+
+Les datagrammes sont réellement envoyés en UDP vers un port local.
+
+Usage :
+    python bench/bench_osc_encoder.py [--frames 50000] [--devices 16] [--json]
+"""
+
+import argparse
+import json
+import socket
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "server"))
+
+from pythonosc.osc_bundle import OscBundle  # noqa: E402
+from pythonosc.osc_message import OscMessage  # noqa: E402
+from pythonosc.udp_client import SimpleUDPClient  # noqa: E402
+
+from osc_encoder import OscFrameEncoder, sanitize_id  # noqa: E402
+from protocol import Frame  # noqa: E402
+
+OSC_BASE = "/mocap"
+SENSOR_ROWS = (("accelerometer", 0), ("gyroscope", 1), ("orientation", 2))
+
+
+def make_frames(n_frames: int, n_devices: int) -> list:
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(n_frames, 5, 3)).astype(np.float32)
+    t0 = time.time() * 1000.0
+    return [
+        Frame(f"device-{i % n_devices:03d}", i, t0 + i * 16.6, 0b00111, values[i])
+        for i in range(n_frames)
+    ]
+
+
+def run_legacy(frames, client) -> int:
+    sent = 0
+    for frame in frames:
+        sid = sanitize_id(frame.device_id)
+        common_args = [frame.seq, int(frame.timestamp)]
+        for name, row in SENSOR_ROWS:
+            args = [a for a in common_args if a is not None]
+            args.extend(frame.values[row].tolist())
+            client.send_message(f"{OSC_BASE}/{sid}/{name}", args)
+            sent += 1
+    return sent
+
+
+def run_messages(frames, encoder, sock, addr) -> int:
+    sent = 0
+    for frame in frames:
+        for message in encoder.encode_messages(frame):
+            sock.sendto(message, addr)
+            sent += 1
+    return sent
+
+
+def run_bundles(frames, encoder, sock, addr) -> int:
+    sent = 0
+    for frame in frames:
+        sock.sendto(encoder.encode_bundle(frame), addr)
+        sent += 3
+    return sent
+
+
+def check_equivalence(frame, encoder):
+    """Vérifie que l'encodeur produit les mêmes messages que python-osc."""
+    expected = []
+    for name, row in SENSOR_ROWS:
+        args = [frame.seq, int(frame.timestamp)] + frame.values[row].tolist()
+        expected.append((f"{OSC_BASE}/{sanitize_id(frame.device_id)}/{name}", args))
+
+    messages = [OscMessage(m) for m in encoder.encode_messages(frame)]
+    bundle = OscBundle(bytes(encoder.encode_bundle(frame)))
+    for decoded in (messages, list(bundle)):
+        got = [(m.address, m.params) for m in decoded]
+        assert got == expected, f"encodage différent de python-osc : {got} != {expected}"
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    n = fn(*args)
+    return n, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=50000)
+    parser.add_argument("--devices", type=int, default=16)
+    parser.add_argument("--json", action="store_true", help="sortie JSON")
+    args = parser.parse_args()
+
+    # Puits UDP local (on ne lit pas : seul le coût d'envoi nous intéresse)
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    addr = sink.getsockname()
+
+    frames = make_frames(args.frames, args.devices)
+    encoder = OscFrameEncoder(OSC_BASE)
+    check_equivalence(frames[0], encoder)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client = SimpleUDPClient(*addr)
+
+    results = {}
+    for name, fn, fn_args in (
+        ("legacy", run_legacy, (frames, client)),
+        ("messages", run_messages, (frames, encoder, sock, addr)),
+        ("bundles", run_bundles, (frames, encoder, sock, addr)),
+    ):
+        n, elapsed = timed(fn, *fn_args)
+        results[name] = {"messages": n, "seconds": elapsed, "messages_per_s": n / elapsed}
+
+    base = results["legacy"]["messages_per_s"]
+    for r in results.values():
+        r["speedup"] = r["messages_per_s"] / base
+
+    if args.json:
+        print(json.dumps({"frames": args.frames, "devices": args.devices, "results": results}, indent=2))
+    else:
+        print(f"{args.frames} trames, {args.devices} devices, 3 messages OSC par trame")
+        for name, r in results.items():
+            print(f"  {name:<9} {r['messages_per_s']:>12,.0f} msg/s  (x{r['speedup']:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+Benchmark de bout en bout : sources → serveur (/ws) → receivers et pont OSC → puits UDP.
+
+Tout tourne en local, chaque étage dans son propre processus :
+- serveur   : server/main.py (avec --workers si demandé) ;
+- pont      : server/osc_sender.py, receiver binaire du serveur, vers le puits ;
+- receivers : N receivers WebSocket supplémentaires (fan-out du ConnectionManager) ;
+- sources   : devices synthétiques à débit fixe (JSON ou binaire), une
+              connexion /ws par device, répartis sur --source-procs processus ;
+- puits OSC : socket UDP qui horodate chaque datagramme à l'arrivée.
+
+Chaque source note l'heure d'envoi de chaque (device, seq). Le receiver 0 et
+le puits notent l'heure d'arrivée ; les latences source → receiver WS et
+source → OSC sont calculées après coup (même horloge : time.time()).
+
+Rapport : p50 / p99 / p999 / max des latences, pertes (envoyées vs reçues,
+compteurs /stats du serveur), métriques internes du serveur (/metrics) et
+CPU de chaque étage (/proc, Linux).
+
+Usage :
+    python bench/bench_pipeline.py [--devices 16] [--rate 60] [--duration 10]
+                                   [--receivers 2] [--format binary] [--workers 0]
+                                   [--json [FICHIER]]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+sys.path.append(str(SERVER_DIR))
+
+import websockets  # noqa: E402
+
+from protocol import encode_frame, decode_message, frame_to_json_dict, Frame  # noqa: E402
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+# -------------------------------------------------------------------
+# CPU par processus (/proc)
+# -------------------------------------------------------------------
+def _descendants(pid: int) -> list:
+    """pid et tous ses descendants (workers d'ingestion...)."""
+    pids = [pid]
+    for p in pids:
+        try:
+            for task in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{task}/children") as f:
+                    pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def cpu_seconds(pid: int) -> float:
+    """Temps CPU (utilisateur + système) de pid et de ses descendants."""
+    total = 0
+    for p in _descendants(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError):
+            pass
+    return total / CLK_TCK
+
+
+# -------------------------------------------------------------------
+# Étages lancés dans des processus séparés
+# -------------------------------------------------------------------
+def _osc_device_seq(datagram: bytes):
+    """(deviceId, seq) du premier message OSC d'un datagramme (bundle ou message)."""
+    if datagram.startswith(b"#bundle\x00"):
+        size = struct.unpack_from(">i", datagram, 16)[0]
+        datagram = datagram[20:20 + size]
+    end = datagram.index(b"\x00")
+    address = datagram[:end].decode()
+    offset = (end + 4) & ~3
+    tags_end = datagram.index(b"\x00", offset)
+    tags = datagram[offset:tags_end].decode()
+    offset = (tags_end + 4) & ~3
+    if tags[1] == "i":
+        seq = struct.unpack_from(">i", datagram, offset)[0]
+    else:
+        seq = struct.unpack_from(">q", datagram, offset)[0]
+    return address.split("/")[-2], seq
+
+
+def run_sink(port: int, ready, stop, results):
+    """Puits OSC : horodate chaque datagramme, décode après l'arrêt."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(("127.0.0.1", port))
+    sock.settimeout(0.2)
+    ready.set()
+    arrivals = []
+    while not stop.is_set():
+        try:
+            data = sock.recv(65535)
+        except socket.timeout:
+            continue
+        arrivals.append((time.time(), data))
+
+    received = {}
+    for t, data in arrivals:
+        try:
+            received[_osc_device_seq(data)] = t
+        except (ValueError, IndexError, struct.error, UnicodeDecodeError):
+            pass
+    results.put(("sink", {"datagrams": len(arrivals), "arrivals": received}))
+
+
+def run_receivers(url: str, n: int, ready, stop, results):
+    """N receivers WebSocket ; le premier note l'heure d'arrivée de chaque trame."""
+    counts = [0] * n
+    arrivals = {}
+
+    async def receiver(i):
+        async with websockets.connect(url, max_queue=None) as ws:
+            ready.release()
+            while not stop.is_set():
+                try:
+                    message = await asyncio.wait_for(ws.recv(), 0.2)
+                except asyncio.TimeoutError:
+                    continue
+                now = time.time()
+                frames = decode_message(message)
+                counts[i] += len(frames)
+                if i == 0:
+                    for frame in frames:
+                        arrivals[(frame.device_id, frame.seq)] = now
+
+    async def main():
+        await asyncio.gather(*(receiver(i) for i in range(n)))
+
+    asyncio.run(main())
+    results.put(("receivers", {"counts": counts, "arrivals": arrivals}))
+
+
+def run_sources(urls: dict, rate: float, duration: float, fmt: str, start_at: float, results):
+    """Devices synthétiques : une connexion /ws par device, une trame tous les 1/rate s."""
+    sent = {}
+    late = [0.0]
+
+    async def device(device_id, url):
+        period = 1.0 / rate
+        n = int(duration * rate)
+        rng = np.random.default_rng(abs(hash(device_id)) % (1 << 32))
+        values = rng.normal(size=(n, 5, 3)).astype(np.float32)
+        times = np.zeros(n)
+        async with websockets.connect(url, max_queue=None) as ws:
+            await asyncio.sleep(max(0.0, start_at - time.time()))
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            for seq in range(n):
+                ahead = start + seq * period - loop.time()
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+                else:
+                    late[0] = max(late[0], -ahead)
+                now = time.time()
+                frame = Frame(device_id, seq, now * 1000.0, 0b00111, values[seq])
+                if fmt == "binary":
+                    await ws.send(encode_frame(device_id, seq, frame.timestamp, frame.values, frame.mask))
+                else:
+                    await ws.send(json.dumps(frame_to_json_dict(frame)))
+                times[seq] = now
+        sent[device_id] = times
+
+    async def main():
+        await asyncio.gather(*(device(d, url) for d, url in urls.items()))
+
+    asyncio.run(main())
+    results.put(("sources", {"sent": sent, "max_late_ms": late[0] * 1000.0}))
+
+
+# -------------------------------------------------------------------
+# Orchestration
+# -------------------------------------------------------------------
+def _get_json(url: str):
+    with urllib.request.urlopen(url, timeout=2) as r:
+        return json.loads(r.read())
+
+
+def _wait_for(predicate, timeout: float, what: str):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if predicate():
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Délai dépassé en attendant {what}")
+
+
+def latency_summary(sent: dict, arrivals: dict) -> dict:
+    lat = [
+        (t - sent[device_id][seq]) * 1000.0
+        for (device_id, seq), t in arrivals.items()
+        if device_id in sent and 0 <= seq < len(sent[device_id])
+    ]
+    if not lat:
+        return {"count": 0}
+    lat = np.array(lat)
+    p50, p99, p999 = np.percentile(lat, [50, 99, 99.9])
+    return {"count": len(lat), "mean_ms": lat.mean(), "p50_ms": p50, "p99_ms": p99,
+            "p999_ms": p999, "max_ms": lat.max()}
+
+
+def run(args) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    stop = ctx.Event()
+    base = f"http://127.0.0.1:{args.port}"
+    ws_base = f"ws://127.0.0.1:{args.port}/ws"
+    processes = {}
+    children = []
+    popens = []
+
+    try:
+        # Puits OSC
+        sink_ready = ctx.Event()
+        sink = ctx.Process(target=run_sink, args=(args.osc_port, sink_ready, stop, results))
+        sink.start()
+        children.append(sink)
+        sink_ready.wait(5)
+        processes["sink"] = sink.pid
+
+        # Serveur
+        server_cmd = [sys.executable, "main.py", "--host", "127.0.0.1", "--port", str(args.port)]
+        if args.workers:
+            server_cmd += ["--workers", str(args.workers)]
+        server = subprocess.Popen(server_cmd, cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        popens.append(server)
+        processes["server"] = server.pid
+        _wait_for(lambda: _get_json(f"{base}/stats") is not None, 15, "le serveur")
+        if args.workers:
+            time.sleep(2)  # démarrage des workers
+
+        # Pont WS → OSC
+        bridge = subprocess.Popen(
+            [sys.executable, "osc_sender.py", "--uri", f"{ws_base}?client_type=receiver&format=binary",
+             "--osc-port", str(args.osc_port)],
+            cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        popens.append(bridge)
+        processes["bridge"] = bridge.pid
+        _wait_for(lambda: len(_get_json(f"{base}/stats")["receivers"]) >= 1, 15, "le pont OSC")
+
+        # Receivers supplémentaires
+        if args.receivers:
+            receivers_ready = ctx.Semaphore(0)
+            receivers = ctx.Process(target=run_receivers, args=(
+                f"{ws_base}?client_type=receiver&format={args.format}", args.receivers,
+                receivers_ready, stop, results,
+            ))
+            receivers.start()
+            children.append(receivers)
+            for _ in range(args.receivers):
+                receivers_ready.acquire(timeout=10)
+            processes["receivers"] = receivers.pid
+
+        # Sources (connexion directe aux workers d'ingestion s'il y en a)
+        device_ids = [f"bench-{i:04d}" for i in range(args.devices)]
+        urls = {}
+        for device_id in device_ids:
+            port = args.port
+            if args.workers:
+                port = _get_json(f"{base}/ingest?deviceId={device_id}")["port"]
+            urls[device_id] = f"ws://127.0.0.1:{port}/ws?client_type=source"
+
+        start_at = time.time() + 1.0
+        sources = []
+        for k in range(args.source_procs):
+            part = dict(list(urls.items())[k::args.source_procs])
+            if part:
+                p = ctx.Process(target=run_sources, args=(part, args.rate, args.duration, args.format, start_at, results))
+                p.start()
+                sources.append(p)
+        children.extend(sources)
+
+        time.sleep(max(0.0, start_at - time.time()))
+        cpu_start = {name: cpu_seconds(pid) for name, pid in processes.items()}
+        source_cpu_start = sum(cpu_seconds(p.pid) for p in sources)
+        t_start = time.time()
+
+        # Résultats des sources (avant join : la file doit être vidée)
+        collected = {"sources": [], "sink": None, "receivers": None}
+        for _ in sources:
+            name, data = results.get(timeout=args.duration + 60)
+            collected[name].append(data)
+        source_cpu = sum(cpu_seconds(p.pid) for p in sources) - source_cpu_start
+        time.sleep(args.drain)
+        elapsed = time.time() - t_start
+        cpu = {name: cpu_seconds(pid) - cpu_start[name] for name, pid in processes.items()}
+        cpu["sources"] = source_cpu
+        server_stats = _get_json(f"{base}/stats")
+        server_metrics = _get_json(f"{base}/metrics")
+
+        stop.set()
+        for _ in range(1 + (1 if args.receivers else 0)):
+            name, data = results.get(timeout=60)
+            collected[name] = data
+    finally:
+        stop.set()
+        for proc in reversed(popens):
+            # Les workers d'ingestion ne suivent pas toujours l'arrêt du serveur
+            for pid in reversed(_descendants(proc.pid)):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            proc.wait(10)
+        for p in children:
+            p.join(5)
+            if p.is_alive():
+                p.terminate()
+
+    sent = {}
+    for part in collected["sources"]:
+        sent.update(part["sent"])
+    n_sent = sum(len(t) for t in sent.values())
+    sink_data = collected["sink"]
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "sent": n_sent,
+        "offered_rate": args.devices * args.rate,
+        "achieved_rate": n_sent / args.duration,
+        "source_max_late_ms": max((p["max_late_ms"] for p in collected["sources"]), default=0.0),
+        "osc": dict(
+            received=len(sink_data["arrivals"]),
+            datagrams=sink_data["datagrams"],
+            dropped=n_sent - len(sink_data["arrivals"]),
+            latency=latency_summary(sent, sink_data["arrivals"]),
+        ),
+        "server": {
+            "receivers": [
+                {k: r.get(k) for k in ("format", "enqueued", "sent", "dropped", "max_depth")}
+                for r in server_stats["receivers"]
+            ],
+            "counters": server_metrics["counters"],
+            "histograms": server_metrics["histograms"],
+        },
+        "cpu_percent": {name: 100.0 * s / elapsed for name, s in cpu.items()},
+    }
+    if collected["receivers"] is not None:
+        counts = collected["receivers"]["counts"]
+        report["ws"] = dict(
+            received=counts,
+            dropped=[n_sent - c for c in counts],
+            latency=latency_summary(sent, collected["receivers"]["arrivals"]),
+        )
+    return report
+
+
+def _print_report(report: dict):
+    c = report["config"]
+    print(f"{c['devices']} devices x {c['rate']:g} Hz ({c['format']}), {c['receivers']} receivers, "
+          f"{c['workers']} workers, {c['duration']:g} s")
+    print(f"  envoyées : {report['sent']} trames ({report['achieved_rate']:.0f}/s pour {report['offered_rate']:.0f}/s demandées, "
+          f"retard max des sources {report['source_max_late_ms']:.1f} ms)")
+    for stage in ("ws", "osc"):
+        if stage not in report:
+            continue
+        r = report[stage]
+        lat = r["latency"]
+        dropped = r["dropped"] if stage == "osc" else max(r["dropped"])
+        if lat["count"]:
+            print(f"  {stage:<4} p50 {lat['p50_ms']:7.2f} ms  p99 {lat['p99_ms']:7.2f} ms  "
+                  f"p999 {lat['p999_ms']:7.2f} ms  max {lat['max_ms']:7.2f} ms  pertes {dropped}")
+        else:
+            print(f"  {stage:<4} aucune trame reçue")
+    print("  CPU   " + "  ".join(f"{name} {pct:.0f}%" for name, pct in report["cpu_percent"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=60.0, help="trames/s par device")
+    parser.add_argument("--duration", type=float, default=10.0, help="durée d'envoi (s)")
+    parser.add_argument("--receivers", type=int, default=2, help="receivers WS en plus du pont OSC")
+    parser.add_argument("--format", choices=("json", "binary"), default="binary")
+    parser.add_argument("--workers", type=int, default=0, help="processus d'ingestion du serveur")
+    parser.add_argument("--source-procs", type=int, default=1, help="processus générant les sources")
+    parser.add_argument("--drain", type=float, default=1.0, help="attente après l'envoi (s)")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--osc-port", type=int, default=9700)
+    parser.add_argument("--json", nargs="?", const="-", default=None, metavar="FICHIER",
+                        help="sortie JSON (stdout, ou dans FICHIER)")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json is None:
+        _print_report(report)
+    else:
+        text = json.dumps(report, indent=2, default=float)
+        if args.json == "-":
+            print(text)
+        else:
+            Path(args.json).write_text(text)
+            _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
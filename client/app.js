@@ -2,6 +2,7 @@
     // ===== UI =====
     const deviceIdInput = document.getElementById('deviceIdInput');
     const intervalInput = document.getElementById('intervalInput');
+    const protocolSelect = document.getElementById('protocolSelect');
     const permissionBtn = document.getElementById('permissionBtn');
     const startBtn = document.getElementById('startBtn');
     const stopBtn = document.getElementById('stopBtn');
@@ -17,6 +18,7 @@
     let sendInterval = Number(intervalInput?.value) || 100;
     let sendTimer = null;
     let sentCount = 0;
+    let useBinary = false;
   
     // ===== latest sensor readings =====
     const sensors = { accelerometer: null, gyroscope: null, rotation: null, orientation: null };
@@ -55,9 +57,19 @@
       else { wsStatus.textContent = 'Disconnected'; wsStatus.style.color = 'red'; }
     }
   
-    function startWebSocket() {
+    // Serveur lancé avec --workers : chaque device a son worker d'ingestion
+    async function resolveSourceHost() {
+      try {
+        const res = await fetch(`/ingest?deviceId=${encodeURIComponent(deviceId)}`);
+        const info = await res.json();
+        if (res.ok && info.workers > 0 && info.port) return `${window.location.hostname}:${info.port}`;
+      } catch (e) { console.warn('Pas de worker d\'ingestion, connexion directe', e); }
+      return window.location.host;
+    }
+
+    async function startWebSocket() {
       const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-      const host = window.location.host;
+      const host = await resolveSourceHost();
       const wsUrl = `${protocol}//${host}/ws?client_type=source`;
       ws = new WebSocket(wsUrl);
       updateWsStatus();
@@ -70,10 +82,48 @@
       if (ws) { try { ws.close(); } catch {} ws = null; updateWsStatus(); }
     }
   
+    // ===== trame binaire (voir server/protocol.py) =====
+    // en-tête : "MC" | version u8 | flags u8 | seq u32 | timestamp f64 | id_len u8 | id | 3 x f32 par capteur
+    const BINARY_SENSORS = [
+      ['accelerometer', ['x', 'y', 'z']],
+      ['gyroscope', ['x', 'y', 'z']],
+      ['orientation', ['alpha', 'beta', 'gamma']],
+      ['magnetometer', ['x', 'y', 'z']],
+      ['gravity', ['x', 'y', 'z']],
+    ];
+    const FLAG_SEQ = 1 << 6, FLAG_TIMESTAMP = 1 << 7;
+    const textEncoder = new TextEncoder();
+
+    function encodeBinaryFrame(seqNum, timestamp) {
+      const id = textEncoder.encode(deviceId).slice(0, 255);
+      let flags = FLAG_SEQ | FLAG_TIMESTAMP, count = 0;
+      BINARY_SENSORS.forEach(([name], i) => { if (sensors[name]) { flags |= 1 << i; count++; } });
+      const buf = new ArrayBuffer(17 + id.length + count * 12);
+      const view = new DataView(buf);
+      view.setUint8(0, 0x4d); view.setUint8(1, 0x43); // "MC"
+      view.setUint8(2, 1);
+      view.setUint8(3, flags);
+      view.setUint32(4, seqNum >>> 0, true);
+      view.setFloat64(8, timestamp, true);
+      view.setUint8(16, id.length);
+      new Uint8Array(buf, 17, id.length).set(id);
+      let off = 17 + id.length;
+      BINARY_SENSORS.forEach(([name, axes]) => {
+        const s = sensors[name];
+        if (!s) return;
+        axes.forEach(k => { view.setFloat32(off, Number(s[k]) || 0, true); off += 4; });
+      });
+      return buf;
+    }
+
     function sendSensorData() {
       if (!ws || ws.readyState !== WebSocket.OPEN) return;
-      const payload = { deviceId, seq: seq++, timestamp: Date.now(), sensors };
-      ws.send(JSON.stringify(payload));
+      if (useBinary) {
+        ws.send(encodeBinaryFrame(seq++, Date.now()));
+      } else {
+        const payload = { deviceId, seq: seq++, timestamp: Date.now(), sensors };
+        ws.send(JSON.stringify(payload));
+      }
       if (lastSentEl) lastSentEl.textContent = new Date().toLocaleTimeString();
       sentCount++; if (sentCountEl) sentCountEl.textContent = sentCount;
     }
@@ -288,6 +338,7 @@
     if (startBtn) startBtn.addEventListener('click', () => {
       deviceId = getOrCreateDeviceId();
       sendInterval = Number(intervalInput?.value) || 100;
+      useBinary = protocolSelect?.value === 'binary';
       startWebSocket();
       startSending();
   
@@ -18,11 +18,73 @@ The output format is a CSV file with the following columns:
 - label
 - ax_1, ay_1, az_1, gx_1, gy_1, gz_1, alpha_1, beta_1, gamma_1, ...
 - ax_60, ay_60, az_60, gx_60, gy_60, gz_60, alpha_60, beta_60, gamma_60
+
+preprocess_to_tensors() is the binary counterpart used for training: it
+parses all five sensor columns (accel, gyro, orientation, mag, gravity)
+straight into NumPy tensors, streaming the input in chunks, and writes
+memory-mappable .npy files next to the CSV:
+- <prefix>_X.npy        float32 (n_rows, 60, 15), NaN where a sensor has no sample
+- <prefix>_t.npy        float32 (n_rows, 5, 60), sample times in ms (NaN padded)
+- <prefix>_lengths.npy  int16 (n_rows, 5), number of samples kept per sensor
+- <prefix>_labels.npy   unicode (n_rows,)
+- <prefix>_X_resampled.npy  float32 (n_rows, 60, 15), every sensor linearly
+  interpolated from all of its samples (not only the first 60) onto the same
+  fixed 60 Hz grid, orientation angles taking the short way round
+  (models/resampling.py, the same code SensorBuffer.add_timed() uses live)
+Open them with load_tensors(prefix), which uses np.load(mmap_mode='r').
+
+preprocess_sessions() does the same for a whole directory / glob of recorded
+sessions (dataset_YYYYMMDD_HHMMSS.csv) in parallel, skips files whose
+content did not change since the last run, and merges everything into one
+dataset with label and session indexes:
+
+    python data_preprocessing.py batch trash/ -o build -j 8
+
+extract_features() computes, from X_resampled, the feature vectors the live
+SensorBuffer(features=True) feeds the model (models/features.py, same code):
+- <prefix>_features.npy       float32 (n_rows, n_features)
+- <prefix>_feature_names.npy  unicode (n_features,)
+
+    python data_preprocessing.py features build/dataset
 '''
 
+import argparse
 import csv
+import glob
+import hashlib
 import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models'))
+from features import dataset_features, feature_names, num_feature_outputs
+from resampling import default_grid, resample_series
+
+N_STEPS = 60
+
+# (CSV column, keys of each sample) in feature order
+SENSOR_COLUMNS = (
+    ('accel', ('ax', 'ay', 'az')),
+    ('gyro', ('gx', 'gy', 'gz')),
+    ('orientation', ('alpha', 'beta', 'gamma')),
+    ('mag', ('mx', 'my', 'mz')),
+    ('gravity', ('gx', 'gy', 'gz')),
+)
+FEATURES = (
+    'ax', 'ay', 'az', 'gx', 'gy', 'gz', 'alpha', 'beta', 'gamma',
+    'mx', 'my', 'mz', 'grav_x', 'grav_y', 'grav_z',
+)
+N_SENSORS = len(SENSOR_COLUMNS)
+N_FEATURES = len(FEATURES)
+
+TENSOR_FILES = ('X', 't', 'lengths', 'labels', 'X_resampled')
+# Channels the live buffer works on (accelerometer, gyroscope, orientation)
+LIVE_FEATURES = FEATURES[:9]
+# Resampling grid: N_STEPS points over one second (sample times are in ms)
+RESAMPLE_GRID = default_grid(N_STEPS, 1000.0)
 
 def preprocess_dataset(input_file, output_file):
     """
@@ -106,10 +168,341 @@ def preprocess_dataset(input_file, output_file):
     print(f"Preprocessing complete! Output saved to {output_file}")
 
 
+def _count_rows(input_file):
+    """
+    Number of data rows (cheap pass: no JSON parsing). Blank lines are not
+    counted, since csv.DictReader skips them when the rows are parsed.
+    """
+    with open(input_file, 'r', encoding='utf-8', newline='') as infile:
+        reader = csv.reader(infile)
+        next(reader, None)
+        return sum(1 for row in reader if row)
+
+
+def _parse_sensor(cell, keys):
+    """
+    Parse one JSON sensor cell into (t (n,), values (n, 3)) float32 arrays
+    holding every sample of the cell, or None when the cell is empty.
+    """
+    samples = json.loads(cell) if cell else None
+    if not samples:
+        return None
+    # None (null in the JSON) becomes NaN
+    values = np.array([[s.get(k) for k in keys] for s in samples], dtype=np.float32)
+    t = np.array([s.get('t') for s in samples], dtype=np.float32)
+    return t, values
+
+
+def tensor_paths(prefix):
+    return {name: f'{prefix}_{name}.npy' for name in TENSOR_FILES}
+
+
+def preprocess_to_tensors(input_file, output_prefix=None, chunk_rows=256):
+    """
+    Preprocess a raw CSV into memory-mappable NumPy tensors (see module docstring).
+
+    The input is streamed: rows are parsed into a preallocated chunk of
+    `chunk_rows` rows, which is then copied into the .npy files opened as
+    memory maps, so the whole recording is never held in memory.
+    X/t keep the first N_STEPS samples of each sensor, but X_resampled is
+    interpolated from all of them (recordings hold up to ~120 per second),
+    kept in a scratch chunk that grows with the longest sensor seen.
+    Returns the dict of written paths.
+    """
+    if output_prefix is None:
+        output_prefix = os.path.splitext(input_file)[0]
+    paths = tensor_paths(output_prefix)
+    n_rows = _count_rows(input_file)
+
+    X = np.lib.format.open_memmap(paths['X'], mode='w+', dtype=np.float32, shape=(n_rows, N_STEPS, N_FEATURES))
+    T = np.lib.format.open_memmap(paths['t'], mode='w+', dtype=np.float32, shape=(n_rows, N_SENSORS, N_STEPS))
+    L = np.lib.format.open_memmap(paths['lengths'], mode='w+', dtype=np.int16, shape=(n_rows, N_SENSORS))
+    R = np.lib.format.open_memmap(
+        paths['X_resampled'], mode='w+', dtype=np.float32, shape=(n_rows, len(RESAMPLE_GRID), N_FEATURES)
+    )
+    labels = []
+
+    chunk_X = np.empty((chunk_rows, N_STEPS, N_FEATURES), dtype=np.float32)
+    chunk_T = np.empty((chunk_rows, N_SENSORS, N_STEPS), dtype=np.float32)
+    chunk_L = np.empty((chunk_rows, N_SENSORS), dtype=np.int16)
+    # Every sample of each sensor, for the resampling
+    full = {
+        'T': np.empty((chunk_rows, N_SENSORS, 2 * N_STEPS), dtype=np.float32),
+        'V': np.empty((chunk_rows, N_SENSORS, 2 * N_STEPS, 3), dtype=np.float32),
+        'L': np.empty((chunk_rows, N_SENSORS), dtype=np.int32),
+    }
+
+    def grow(size):
+        capacity = full['T'].shape[2]
+        while capacity < size:
+            capacity *= 2
+        for name in ('T', 'V'):
+            old = full[name]
+            full[name] = np.empty(old.shape[:2] + (capacity,) + old.shape[3:], dtype=old.dtype)
+            full[name][:, :, :old.shape[2]] = old
+
+    def flush(start, count):
+        X[start:start + count] = chunk_X[:count]
+        T[start:start + count] = chunk_T[:count]
+        L[start:start + count] = chunk_L[:count]
+        size = max(int(full['L'][:count].max()), 1)
+        R[start:start + count] = resample_series(
+            full['T'][:count, :, :size], full['V'][:count, :, :size], full['L'][:count], RESAMPLE_GRID
+        )
+
+    with open(input_file, 'r', encoding='utf-8', newline='') as infile:
+        reader = csv.DictReader(infile)
+        row_index = 0
+        k = 0
+        for row in reader:
+            if row_index + k >= n_rows:
+                break
+            chunk_X[k] = np.nan
+            chunk_T[k] = np.nan
+            full['T'][k] = np.nan
+            full['V'][k] = np.nan
+            for s, (column, keys) in enumerate(SENSOR_COLUMNS):
+                parsed = _parse_sensor(row.get(column), keys)
+                n = 0 if parsed is None else len(parsed[0])
+                chunk_L[k, s] = min(n, N_STEPS)
+                full['L'][k, s] = n
+                if not n:
+                    continue
+                t, values = parsed
+                chunk_X[k, :chunk_L[k, s], 3 * s:3 * s + 3] = values[:N_STEPS]
+                chunk_T[k, s, :chunk_L[k, s]] = t[:N_STEPS]
+                if n > full['T'].shape[2]:
+                    grow(n)
+                full['T'][k, s, :n] = t
+                full['V'][k, s, :n] = values
+            labels.append(row['label'])
+            k += 1
+            if k == chunk_rows:
+                flush(row_index, k)
+                row_index += k
+                k = 0
+        if k:
+            flush(row_index, k)
+
+    for array in (X, T, L, R):
+        array.flush()
+    del X, T, L, R
+    np.save(paths['labels'], np.array(labels, dtype=str))
+
+    print(f"Tensor preprocessing complete! {n_rows} rows saved to {output_prefix}_*.npy")
+    return paths
+
+
+def load_tensors(prefix, mmap_mode='r'):
+    """Open the tensors written by preprocess_to_tensors() without parsing any text."""
+    return {name: np.load(path, mmap_mode=mmap_mode) for name, path in tensor_paths(prefix).items()}
+
+
+MANIFEST_NAME = 'manifest.json'
+INDEX_FILES = ('session', 'label_index', 'label_names', 'sessions')
+
+
+def file_digest(path, block_size=1 << 20):
+    """SHA-256 of a file's content."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_raw_dataset(path):
+    """True if the CSV has the raw recorder columns (not an already clean file)."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        header = next(csv.reader(f), [])
+    return 'label' in header and 'accel' in header
+
+
+def expand_inputs(inputs):
+    """Raw CSV files from a list of files, directories and glob patterns."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, '*.csv'))
+        else:
+            matches = glob.glob(item)
+        files.extend(os.path.abspath(m) for m in sorted(matches))
+    return [f for f in dict.fromkeys(files) if is_raw_dataset(f)]
+
+
+def _load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'files': {}, 'merged': None}
+
+
+def _session_digest(path, previous):
+    """Content hash, reusing the previous one when size and mtime are unchanged."""
+    st = os.stat(path)
+    if previous and previous.get('size') == st.st_size and previous.get('mtime') == st.st_mtime:
+        return previous['sha256'], st
+    return file_digest(path), st
+
+
+def _preprocess_job(job):
+    input_file, prefix = job
+    preprocess_to_tensors(input_file, prefix)
+    return input_file
+
+
+def preprocess_sessions(inputs, output_dir, jobs=None, name='dataset'):
+    """
+    Preprocess many raw CSV files in parallel and merge them into
+    <output_dir>/<name>_*.npy, plus:
+    - <name>_session.npy      int32 (n_rows,), index into <name>_sessions.npy
+    - <name>_sessions.npy     source file of each session
+    - <name>_label_index.npy  int16 (n_rows,), index into <name>_label_names.npy
+    - <name>_label_names.npy  sorted label names
+
+    Per-file tensors are cached in <output_dir>/sessions/ under their content
+    hash; a manifest records the hashes so unchanged files are not parsed
+    again. Cache entries of files that are gone or changed are deleted when
+    the manifest is rewritten. Returns the merged prefix.
+    """
+    files = expand_inputs(inputs)
+    if not files:
+        raise ValueError(f'No raw dataset CSV found in {inputs}')
+
+    sessions_dir = os.path.join(output_dir, 'sessions')
+    os.makedirs(sessions_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+
+    entries = {}
+    todo = []
+    for path in files:
+        previous = manifest['files'].get(path)
+        digest, st = _session_digest(path, previous)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        prefix = os.path.join(sessions_dir, f'{stem}-{digest[:12]}')
+        entries[path] = {'sha256': digest, 'size': st.st_size, 'mtime': st.st_mtime, 'prefix': prefix}
+        if not all(os.path.exists(p) for p in tensor_paths(prefix).values()):
+            todo.append((path, prefix))
+
+    print(f'{len(files)} session(s), {len(todo)} to preprocess, {len(files) - len(todo)} cached')
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for done in pool.map(_preprocess_job, todo):
+                print(f'  done: {done}')
+
+    merged_prefix = os.path.join(output_dir, name)
+    merged_key = [entries[path]['sha256'] for path in files]
+    merged_files = list(tensor_paths(merged_prefix).values()) + [f'{merged_prefix}_{n}.npy' for n in INDEX_FILES]
+    if manifest.get('merged') == merged_key and all(os.path.exists(p) for p in merged_files):
+        print(f'Merged dataset up to date: {merged_prefix}_*.npy')
+    else:
+        _merge_sessions([entries[path]['prefix'] for path in files], files, merged_prefix)
+
+    manifest = {'files': entries, 'merged': merged_key}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    _prune_sessions(sessions_dir, entries.values())
+    return merged_prefix
+
+
+def _prune_sessions(sessions_dir, entries):
+    """Delete cached session tensors that the current manifest no longer references."""
+    keep = {p for entry in entries for p in tensor_paths(entry['prefix']).values()}
+    removed = 0
+    for path in glob.glob(os.path.join(sessions_dir, '*.npy')):
+        if path not in keep:
+            os.remove(path)
+            removed += 1
+    if removed:
+        print(f'Removed {removed} stale cache file(s) from {sessions_dir}')
+
+
+def _merge_sessions(prefixes, files, merged_prefix):
+    sessions = [load_tensors(prefix) for prefix in prefixes]
+    n_rows = sum(len(s['labels']) for s in sessions)
+    paths = tensor_paths(merged_prefix)
+
+    merged = {
+        name: np.lib.format.open_memmap(
+            paths[name], mode='w+', dtype=sessions[0][name].dtype,
+            shape=(n_rows,) + sessions[0][name].shape[1:],
+        )
+        for name in TENSOR_FILES if name != 'labels'
+    }
+    session_index = np.empty(n_rows, dtype=np.int32)
+    labels = []
+    start = 0
+    for i, s in enumerate(sessions):
+        n = len(s['labels'])
+        for name, array in merged.items():
+            array[start:start + n] = s[name]
+        session_index[start:start + n] = i
+        labels.extend(s['labels'].tolist())
+        start += n
+    for array in merged.values():
+        array.flush()
+    del merged, sessions
+
+    label_names, label_index = np.unique(np.array(labels, dtype=str), return_inverse=True)
+    np.save(paths['labels'], np.array(labels, dtype=str))
+    np.save(f'{merged_prefix}_label_names.npy', label_names)
+    np.save(f'{merged_prefix}_label_index.npy', label_index.astype(np.int16))
+    np.save(f'{merged_prefix}_session.npy', session_index)
+    np.save(f'{merged_prefix}_sessions.npy', np.array(files, dtype=str))
+    print(f'Merged {len(files)} session(s), {n_rows} rows into {merged_prefix}_*.npy')
+
+
+def load_dataset(prefix, mmap_mode='r'):
+    """Open a merged dataset written by preprocess_sessions()."""
+    data = load_tensors(prefix, mmap_mode)
+    for name in INDEX_FILES:
+        data[name] = np.load(f'{prefix}_{name}.npy', mmap_mode=mmap_mode)
+    return data
+
+
+def extract_features(prefix, n_channels=len(LIVE_FEATURES), window_size=None, chunk_rows=4096):
+    """
+    Write <prefix>_features.npy: the feature vector (models/features.py) of
+    every resampled row, on its first `n_channels` channels. Computed chunk
+    by chunk from the memory-mapped X_resampled. Returns the features path.
+    """
+    X = np.load(f'{prefix}_X_resampled.npy', mmap_mode='r')[:, :, :n_channels]
+    path = f'{prefix}_features.npy'
+    out = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float32, shape=(len(X), num_feature_outputs(n_channels))
+    )
+    dataset_features(X, window_size, chunk_rows, out=out)
+    out.flush()
+    del out
+    np.save(f'{prefix}_feature_names.npy', np.array(feature_names(list(FEATURES[:n_channels])), dtype=str))
+    print(f"Feature extraction complete! {len(X)} rows saved to {path}")
+    return path
+
+
 if __name__ == "__main__":
-    # Default input and output file paths
-    input_file = os.path.join(os.path.dirname(__file__), 'dataset1_3x40.csv')
-    output_file = os.path.join(os.path.dirname(__file__), 'dataset1_3x40_clean.csv')
-    
-    preprocess_dataset(input_file, output_file)
+    parser = argparse.ArgumentParser(description='Preprocess raw motion recordings.')
+    subparsers = parser.add_subparsers(dest='command')
+    batch = subparsers.add_parser('batch', help='preprocess and merge many recorded sessions in parallel')
+    batch.add_argument('inputs', nargs='+', help='CSV files, directories or glob patterns')
+    batch.add_argument('-o', '--output-dir', default=os.path.join(os.path.dirname(__file__), 'build'))
+    batch.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: CPU count)')
+    batch.add_argument('--name', default='dataset', help='name of the merged dataset')
+    features = subparsers.add_parser('features', help='extract the live feature vectors of preprocessed tensors')
+    features.add_argument('prefix', help='tensor prefix (e.g. build/dataset)')
+    features.add_argument('--window', type=int, default=None, help='window size (default: all resampled steps)')
+    args = parser.parse_args()
+
+    if args.command == 'batch':
+        preprocess_sessions(args.inputs, args.output_dir, args.jobs, args.name)
+    elif args.command == 'features':
+        extract_features(args.prefix, window_size=args.window)
+    else:
+        # Default input and output file paths
+        input_file = os.path.join(os.path.dirname(__file__), 'dataset1_3x40.csv')
+        output_file = os.path.join(os.path.dirname(__file__), 'dataset1_3x40_clean.csv')
+
+        preprocess_dataset(input_file, output_file)
+        preprocess_to_tensors(input_file)
 
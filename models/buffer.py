@@ -1,47 +1,190 @@
-import collections
 import numpy as np
 import time
 
+import instruments
+from features import OnlineFeatures
+from instruments import counter, histogram
+from model_registry import load_model
+from resampling import StreamResampler
+
+# Mesurés une fois un registre branché (voir instruments.py)
+inference_time = histogram("inference")
+inference_batch_time = histogram("inference.batch")
+inference_windows = counter("inference.windows")
+inference_errors = counter("inference.errors")
+
 class SensorBuffer:
-    def __init__(self, window_size, step_size, num_features):
+    """
+    Fenêtre glissante d'échantillons capteurs (window_size x num_features).
+
+    Les échantillons sont stockés dans un tableau float32 préalloué de
+    2 * window_size lignes : chaque échantillon est écrit deux fois (en i et
+    en i + window_size), la fenêtre courante est donc toujours une vue
+    contiguë, sans copie ni allocation à chaque pas.
+
+    add_batch() ingère d'un coup un bloc (n, num_features), par exemple les
+    vues lues dans la mémoire partagée du serveur (values[:, :9]).
+
+    Si `on_window` est fourni, le buffer ne charge pas de modèle : chaque
+    fenêtre prête est passée à on_window(window) à la place de
+    process_window() (utilisé par SensorBufferPool).
+
+    Avec `resample_hz`, add_timed(t_ms, sample) rééchantillonne les
+    échantillons horodatés sur une grille fixe avant de les ajouter (même
+    interpolation que resample_tensors() à l'entraînement, voir resampling.py).
+
+    Avec `features`, le modèle (ou on_window) reçoit le vecteur de
+    caractéristiques de la fenêtre (voir features.py) au lieu de la fenêtre
+    brute ; il est tenu à jour à chaque échantillon. `features` vaut True
+    (extracteur propre au buffer) ou un OnlineFeatures partagé, dont le buffer
+    occupe l'emplacement `feature_slot` (réservé si None).
+    """
+    def __init__(self, window_size, step_size, num_features, on_window=None, model_path=None,
+                 resample_hz=None, features=False, feature_slot=None):
         self.window_size = window_size
         self.step_size = step_size
         self.num_features = num_features
+        self.on_window = on_window
+        self.resampler = StreamResampler(resample_hz, num_features) if resample_hz else None
+
+        self.features = None
+        if features is True:
+            features = OnlineFeatures(window_size, num_features)
+        if features:
+            self.features = features
+            self.feature_slot = features.add_device() if feature_slot is None else feature_slot
         
-        self.window_buffer = collections.deque(maxlen=window_size)
+        self._data = np.zeros((2 * window_size, num_features), dtype=np.float32)
+        self._pos = 0            # prochaine position d'écriture (modulo window_size)
+        self.sample_count = 0    # nombre total d'échantillons reçus
         self.new_sample_counter = 0
+
+        if on_window is not None:
+            self.model = None
+            return
         
         # --- CHARGEMENT DU MODÈLE ---
-        # Charge ton modèle ML (ex: .pkl, .h5, .pt) UNE SEULE FOIS
+        # Chargé UNE SEULE FOIS par processus et partagé entre les buffers (voir
+        # model_registry.py). Sans chemin, un modèle bouche-trou prédit toujours 10.
         try:
-            # Remplace 'mon_modele.pkl' par le chemin vers ton fichier
-            self.model =  True #'''joblib.load('mon_modele.pkl')'''
-            print("[Buffer] Modèle 'mon_modele.pkl' chargé avec succès.")
+            self.model = load_model(model_path, warmup_shape=self.input_shape)
         except FileNotFoundError:
-            print("[Buffer] ATTENTION: 'mon_modele.pkl' non trouvé. Le buffer fonctionnera sans prédiction.")
+            print(f"[Buffer] ATTENTION: '{model_path}' non trouvé. Le buffer fonctionnera sans prédiction.")
             self.model = None
         except Exception as e:
             print(f"[Buffer] Erreur au chargement du modèle: {e}")
             self.model = None
 
+    @property
+    def input_shape(self):
+        """Forme d'une entrée du modèle : fenêtre brute ou vecteur de caractéristiques."""
+        if self.features is not None:
+            return (self.features.num_outputs,)
+        return (self.window_size, self.num_features)
+
+    def window(self):
+        """Vue (window_size, num_features) sur la fenêtre courante, du plus ancien au plus récent."""
+        return self._data[self._pos:self._pos + self.window_size]
+
+    def model_input(self):
+        """Entrée du modèle pour la fenêtre courante (voir input_shape)."""
+        if self.features is not None:
+            return self.features.features([self.feature_slot])[0]
+        return self.window()
+
+    def _write(self, samples):
+        """Écrit un bloc d'échantillons dans le tampon miroir."""
+        n = len(samples)
+        w = self.window_size
+        if n >= w:
+            # Seuls les window_size derniers échantillons restent visibles
+            self._pos = (self._pos + n - w) % w
+            samples = samples[n - w:]
+            n = w
+
+        pos = self._pos
+        first = min(n, w - pos)
+        self._data[pos:pos + first] = samples[:first]
+        self._data[pos + w:pos + w + first] = samples[:first]
+        rest = n - first
+        if rest:
+            self._data[:rest] = samples[first:]
+            self._data[w:w + rest] = samples[first:]
+        self._pos = (pos + n) % w
+        if self.features is not None:
+            self.features.push_block(self.feature_slot, samples)
+
+    def _window_ready(self):
+        return self.sample_count >= self.window_size and self.new_sample_counter >= self.step_size
+
+    def _handle_window(self):
+        if self.on_window is not None:
+            return self.on_window(self.model_input())
+        return self.process_window()
+
     def add_data(self, sample):
         if len(sample) != self.num_features:
             print(f"Erreur : L'échantillon a {len(sample)} features, mais {self.num_features} sont attendues.")
             return
 
-        self.window_buffer.append(sample)
+        pos = self._pos
+        self._data[pos] = sample
+        self._data[pos + self.window_size] = sample
+        self._pos = (pos + 1) % self.window_size
+        if self.features is not None:
+            self.features.push([self.feature_slot], np.asarray(sample, dtype=np.float32)[None])
+        self.sample_count += 1
         self.new_sample_counter += 1
 
-        if len(self.window_buffer) == self.window_size:
-            if self.new_sample_counter >= self.step_size:
-                result = self.process_window()
-                self.new_sample_counter = 0
-                return result
-            else:
-                return None
+        if self._window_ready():
+            result = self._handle_window()
+            self.new_sample_counter = 0
+            return result
         else:
             return None
 
+    def add_batch(self, samples):
+        """
+        Ingère un bloc (n, num_features) d'échantillons.
+        Retourne la liste des résultats de process_window() (ou on_window), un par fenêtre
+        complétée pendant le bloc (dans l'ordre).
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim != 2 or samples.shape[1] != self.num_features:
+            print(f"Erreur : bloc de forme {samples.shape}, (n, {self.num_features}) attendu.")
+            return []
+
+        results = []
+        i, n = 0, len(samples)
+        while i < n:
+            # Nombre d'échantillons avant la prochaine fenêtre complète
+            needed = max(self.window_size - self.sample_count, self.step_size - self.new_sample_counter, 1)
+            chunk = samples[i:i + needed]
+            self._write(chunk)
+            self.sample_count += len(chunk)
+            self.new_sample_counter += len(chunk)
+            i += len(chunk)
+
+            if self._window_ready():
+                results.append(self._handle_window())
+                self.new_sample_counter = 0
+        return results
+
+    def add_timed(self, t_ms, sample):
+        """
+        Ajoute un échantillon horodaté (ms). Avec resample_hz, seuls les points
+        de la grille fixe sont ajoutés (0, 1 ou plusieurs selon l'écart avec
+        l'échantillon précédent). Retourne la liste des résultats, comme add_batch().
+        """
+        if self.resampler is None:
+            result = self.add_data(sample)
+            return [] if result is None else [result]
+        if len(sample) != self.num_features:
+            print(f"Erreur : L'échantillon a {len(sample)} features, mais {self.num_features} sont attendues.")
+            return []
+        samples = self.resampler.push(t_ms, sample)
+        return self.add_batch(samples) if len(samples) else []
+
     def process_window(self):
         """
         C'EST ICI QUE LA MAGIE OPÈRE.
@@ -49,8 +192,9 @@ class SensorBuffer:
         """
         
         # 1. Préparer les données pour le modèle
-        # window_data aura la forme (WINDOW_SIZE, NUM_FEATURES)
-        window_data = np.array(list(self.window_buffer))
+        # window_data aura la forme (WINDOW_SIZE, NUM_FEATURES), ou
+        # (N_CARACTÉRISTIQUES,) avec l'extracteur de caractéristiques
+        window_data = self.model_input()
         
         # 2. Vérifier si le modèle est chargé
         if self.model:
@@ -62,29 +206,162 @@ class SensorBuffer:
                 model_input = np.expand_dims(window_data, axis=0)
                 
                 # 4. PRÉDICTION
-                start_time = time.time()
-                ''' prediction = self.model.predict(model_input) '''
-                resultat = 10
-                end_time = time.time()
-                
-                print("INPUTS IN BUFFER : ", model_input)
+                start_time = time.perf_counter()
+                prediction = self.model.predict(model_input)
+                end_time = time.perf_counter()
+                inference_time.record(end_time - start_time)
+                inference_windows.inc()
                 
                 # 5. UTILISER LE RÉSULTAT
                 # 'prediction' peut être [0] ou [[0.1, 0.9]] selon ton modèle
-                ''' resultat = prediction[0] '''
+                resultat = prediction[0]
                 
-                print(f"--- PRÉDICTION ML ---")
-                print(f"  Résultat: {resultat} (calculé en {(end_time - start_time) * 1000:.2f} ms)")
-                print(f"  Basé sur une fenêtre de {window_data.shape}")
-                print(f"----------------------")
+                # Détail d'une fenêtre sur LOG_SAMPLE_EVERY, en mode debug seulement
+                # (les temps de prédiction sont dans les métriques "inference")
+                if instruments.debug_sampled("inference"):
+                    print("INPUTS IN BUFFER : ", model_input)
+                    print(f"--- PRÉDICTION ML ---")
+                    print(f"  Résultat: {resultat} (calculé en {(end_time - start_time) * 1000:.2f} ms)")
+                    print(f"  Basé sur une fenêtre de {window_data.shape}")
+                    print(f"----------------------")
 
                 # use the result to send it back as a websocket message 
                 # can also send a OSC message to the receiver
                 return resultat
 
             except Exception as e:
+                inference_errors.inc()
                 print(f"[ML Error] Erreur lors de la prédiction: {e}")
                 return None
         else:
             print(f"Traitement fenêtre {window_data.shape}, mais aucun modèle n'est chargé.")
-            return None
\ No newline at end of file
+            return None
+
+
+class SensorBufferPool:
+    """
+    Un SensorBuffer par device (clé : deviceId), avec inférence groupée.
+
+    Les fenêtres prêtes de tous les devices sont copiées dans un batch
+    préalloué (max_batch, window_size, num_features) ; un seul appel au
+    modèle traite tout le batch et chaque résultat est rendu à son device.
+
+    Le batch part :
+    - dès qu'il est plein (dans add / add_batch) ;
+    - quand la plus ancienne fenêtre en attente dépasse latency_budget_ms
+      (poll(), à appeler régulièrement, ex: à chaque tick de la boucle) ;
+    - à la demande (flush(), ex: en fin de tick pour traiter ensemble toutes
+      les fenêtres arrivées pendant ce tick).
+
+    Les résultats sont retournés sous forme de liste [(deviceId, résultat)]
+    et, si on_result est fourni, passés à on_result(deviceId, résultat).
+
+    `model` : objet avec predict(batch) ; par défaut, le modèle `model_path`
+    du registre (chargé une fois par processus, avec warm-up).
+
+    `resample_hz` : rééchantillonnage des buffers pour add_timed().
+
+    `features` : le modèle reçoit un batch de vecteurs de caractéristiques
+    (max_batch, F) au lieu des fenêtres brutes ; l'état glissant de tous les
+    devices est tenu dans un seul OnlineFeatures (un emplacement par device).
+    """
+    def __init__(self, window_size, step_size, num_features, model=None,
+                 max_batch=64, latency_budget_ms=10.0, on_result=None, model_path=None,
+                 resample_hz=None, features=False):
+        self.window_size = window_size
+        self.step_size = step_size
+        self.num_features = num_features
+        self.resample_hz = resample_hz
+        self.features = OnlineFeatures(window_size, num_features) if features else None
+        input_shape = (self.features.num_outputs,) if features else (window_size, num_features)
+        if model is None:
+            model = load_model(model_path, warmup_shape=input_shape)
+        self.model = model
+        self.max_batch = max_batch
+        self.latency_budget = latency_budget_ms / 1000.0
+        self.on_result = on_result
+
+        self.buffers = {}
+        self._batch = np.zeros((max_batch,) + input_shape, dtype=np.float32)
+        self._pending = []          # deviceId de chaque fenêtre du batch en cours
+        self._oldest = None         # instant d'arrivée de la plus ancienne fenêtre en attente
+        self._results = []          # résultats des batchs partis pendant un add
+
+        # Statistiques
+        self.batches = 0
+        self.windows = 0
+
+    def buffer(self, device_id):
+        """SensorBuffer du device, créé à la première utilisation."""
+        buf = self.buffers.get(device_id)
+        if buf is None:
+            buf = self.buffers[device_id] = SensorBuffer(
+                self.window_size, self.step_size, self.num_features,
+                on_window=lambda window, device_id=device_id: self._enqueue(device_id, window),
+                resample_hz=self.resample_hz,
+                features=self.features,
+            )
+        return buf
+
+    def _enqueue(self, device_id, window):
+        if len(self._pending) == self.max_batch:
+            self._results.extend(self.flush())
+        self._batch[len(self._pending)] = window
+        self._pending.append(device_id)
+        if self._oldest is None:
+            self._oldest = time.perf_counter()
+
+    def _collect(self):
+        results, self._results = self._results, []
+        if len(self._pending) == self.max_batch:
+            results.extend(self.flush())
+        return results
+
+    def add(self, device_id, sample):
+        """Ajoute un échantillon d'un device ; retourne les résultats des batchs partis."""
+        self.buffer(device_id).add_data(sample)
+        return self._collect()
+
+    def add_batch(self, device_id, samples):
+        """Ajoute un bloc (n, num_features) d'un device ; retourne les résultats des batchs partis."""
+        self.buffer(device_id).add_batch(samples)
+        return self._collect()
+
+    def add_timed(self, device_id, t_ms, sample):
+        """Ajoute un échantillon horodaté (ms) d'un device ; retourne les résultats des batchs partis."""
+        self.buffer(device_id).add_timed(t_ms, sample)
+        return self._collect()
+
+    def poll(self):
+        """Envoie le batch partiel si la plus ancienne fenêtre a épuisé son budget de latence."""
+        if self._oldest is not None and time.perf_counter() - self._oldest >= self.latency_budget:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Un seul appel au modèle pour toutes les fenêtres en attente."""
+        n = len(self._pending)
+        if n == 0:
+            return []
+
+        batch = self._batch[:n]
+        start = time.perf_counter()
+        try:
+            predictions = self.model.predict(batch)
+            inference_batch_time.record(time.perf_counter() - start)
+            inference_windows.inc(n)
+        except Exception as e:
+            inference_errors.inc()
+            print(f"[ML Error] Erreur lors de la prédiction groupée ({n} fenêtres): {e}")
+            predictions = [None] * n
+
+        results = list(zip(self._pending, predictions))
+        self._pending = []
+        self._oldest = None
+        self.batches += 1
+        self.windows += n
+
+        if self.on_result is not None:
+            for device_id, result in results:
+                self.on_result(device_id, result)
+        return results
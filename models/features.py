@@ -0,0 +1,222 @@
+"""
+Extraction de caractéristiques sur les fenêtres de capteurs.
+
+Plutôt que la fenêtre brute (window_size, C), un classifieur léger peut
+travailler sur un vecteur de caractéristiques, pour chaque canal :
+- moyenne, écart-type (population), min, max ;
+- jerk : moyenne de |x[i] - x[i-1]| ;
+- passages par zéro : proportion des paires consécutives de signes opposés ;
+- énergie par bande de fréquence : somme des |X_k|² / window_size sur les
+  raies k = 1..window_size // 2 (DC exclue), réparties en n_bands bandes ;
+et pour chaque capteur (triplet de canaux) la norme moyenne du vecteur.
+L'ordre et les noms sont donnés par feature_names().
+
+Le même vecteur est calculé :
+- hors ligne : window_features() sur un lot (B, window_size, C), par exemple
+  X_resampled de data_preprocessing.py (dataset_features() par blocs) ;
+- en direct : OnlineFeatures, mis à jour à chaque échantillon avec des sommes
+  glissantes (O(C) par échantillon) et une DFT glissante (O(window_size * C)),
+  vectorisé sur tous les devices. Seuls min et max sont recalculés sur la
+  fenêtre, au moment de la lire. Toutes les window_size mises à jour, l'état
+  d'un device est recalculé exactement, ce qui efface la dérive numérique.
+Modèles entraînés et inférence en direct voient donc les mêmes valeurs.
+"""
+
+import numpy as np
+
+N_BANDS = 4
+STATS = ("mean", "std", "min", "max", "jerk", "zero_cross")
+
+
+def band_edges(window_size, n_bands=N_BANDS):
+    """Limites [début, fin[ des bandes, en indices de raies (1..window_size // 2)."""
+    n_bins = window_size // 2
+    if n_bins < n_bands:
+        raise ValueError(f"Fenêtre trop courte ({window_size}) pour {n_bands} bandes")
+    return np.linspace(1, n_bins + 1, n_bands + 1).astype(int)
+
+
+def feature_names(channels, n_bands=N_BANDS):
+    """Noms des caractéristiques, dans l'ordre du vecteur (channels : noms des canaux)."""
+    names = [f"{c}_{stat}" for stat in STATS for c in channels]
+    names += [f"{'_'.join(channels[i:i + 3])}_magnitude" for i in range(0, len(channels) - 2, 3)]
+    names += [f"{c}_band{b}" for b in range(n_bands) for c in channels]
+    return names
+
+
+def num_feature_outputs(num_features, n_bands=N_BANDS):
+    return len(STATS) * num_features + num_features // 3 + n_bands * num_features
+
+
+def _band_energy(spectrum, edges, window_size):
+    """spectrum : (..., n_bins, C) raies 1..n_bins ; retourne (..., n_bands * C)."""
+    power = np.abs(spectrum) ** 2 / window_size
+    bands = np.add.reduceat(power, edges[:-1] - 1, axis=-2)
+    return bands.reshape(bands.shape[:-2] + (-1,))
+
+
+def window_features(windows, n_bands=N_BANDS):
+    """Caractéristiques d'un lot de fenêtres (B, window_size, C) -> (B, F) float32."""
+    x = np.asarray(windows, dtype=np.float64)
+    B, W, C = x.shape
+    G = C // 3
+    diff = np.diff(x, axis=1)
+    sign = np.sign(x)
+    norms = np.linalg.norm(x[:, :, :3 * G].reshape(B, W, G, 3), axis=3)
+    spectrum = np.fft.rfft(x, axis=1)[:, 1:W // 2 + 1]
+    return np.concatenate([
+        x.mean(axis=1),
+        x.std(axis=1),
+        x.min(axis=1),
+        x.max(axis=1),
+        np.abs(diff).mean(axis=1),
+        (sign[:, 1:] * sign[:, :-1] < 0).mean(axis=1),
+        norms.mean(axis=1),
+        _band_energy(spectrum, band_edges(W, n_bands), W),
+    ], axis=1).astype(np.float32)
+
+
+def dataset_features(X, window_size=None, chunk_rows=4096, n_bands=N_BANDS, out=None):
+    """
+    Caractéristiques de tout un tenseur (n, steps, C) (mappé en mémoire ou non),
+    par blocs de chunk_rows lignes ; une fenêtre = les window_size derniers pas.
+    Les NaN (capteur absent) se propagent aux caractéristiques concernées.
+    `out` : tableau (n, F) où écrire (ex: np.lib.format.open_memmap).
+    """
+    n, steps, C = X.shape
+    W = window_size or steps
+    if out is None:
+        out = np.empty((n, num_feature_outputs(C, n_bands)), dtype=np.float32)
+    for start in range(0, n, chunk_rows):
+        out[start:start + chunk_rows] = window_features(X[start:start + chunk_rows, steps - W:], n_bands)
+    return out
+
+
+class OnlineFeatures:
+    """
+    Caractéristiques glissantes de plusieurs devices (un emplacement par
+    device, voir add_device()). L'historique d'un nouvel emplacement vaut 0 :
+    les caractéristiques ne sont celles de window_features() qu'une fois
+    window_size échantillons reçus (ce que garantit SensorBuffer).
+    """
+
+    def __init__(self, window_size, num_features, n_bands=N_BANDS, capacity=8):
+        self.window_size = window_size
+        self.num_features = num_features
+        self.n_bands = n_bands
+        self.n_sensors = num_features // 3
+        self.edges = band_edges(window_size, n_bands)
+        self.n_bins = window_size // 2
+        self.num_outputs = num_feature_outputs(num_features, n_bands)
+        # Rotation de chaque raie à chaque pas de la DFT glissante
+        self._twiddle = np.exp(2j * np.pi * np.arange(1, self.n_bins + 1) / window_size)[None, :, None]
+        self.n_devices = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        W, C, G = self.window_size, self.num_features, self.n_sensors
+        old = getattr(self, "_ring", None)
+        arrays = {
+            "_ring": np.zeros((capacity, W, C), dtype=np.float64),
+            "_pos": np.zeros(capacity, dtype=np.int64),
+            "_sum": np.zeros((capacity, C)),
+            "_sumsq": np.zeros((capacity, C)),
+            "_jerk": np.zeros((capacity, C)),
+            "_zc": np.zeros((capacity, C)),
+            "_norm": np.zeros((capacity, G)),
+            "_dft": np.zeros((capacity, self.n_bins, C), dtype=np.complex128),
+        }
+        for name, array in arrays.items():
+            if old is not None:
+                array[:self.n_devices] = getattr(self, name)[:self.n_devices]
+            setattr(self, name, array)
+
+    def add_device(self) -> int:
+        """Réserve un emplacement (état à zéro) et retourne son indice."""
+        if self.n_devices == len(self._pos):
+            self._allocate(2 * len(self._pos))
+        slot = self.n_devices
+        self.n_devices += 1
+        return slot
+
+    def push(self, slots, samples):
+        """
+        Ajoute un échantillon pour chacun des devices `slots` (indices distincts) :
+        samples (len(slots), C).
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        new = np.asarray(samples, dtype=np.float64).reshape(len(slots), self.num_features)
+        W = self.window_size
+        pos = self._pos[slots]
+        ring = self._ring[slots]
+        rows = np.arange(len(slots))
+        oldest = ring[rows, pos]
+        second = ring[rows, (pos + 1) % W]
+        last = ring[rows, (pos - 1) % W]
+
+        self._sum[slots] += new - oldest
+        self._sumsq[slots] += new * new - oldest * oldest
+        self._jerk[slots] += np.abs(new - last) - np.abs(second - oldest)
+        self._zc[slots] += (np.sign(new) * np.sign(last) < 0).astype(np.float64) \
+            - (np.sign(second) * np.sign(oldest) < 0)
+        G = self.n_sensors
+        self._norm[slots] += np.linalg.norm(new[:, :3 * G].reshape(-1, G, 3), axis=2) \
+            - np.linalg.norm(oldest[:, :3 * G].reshape(-1, G, 3), axis=2)
+        self._dft[slots] = (self._dft[slots] + (new - oldest)[:, None, :]) * self._twiddle
+
+        self._ring[slots, pos] = new
+        pos = (pos + 1) % W
+        self._pos[slots] = pos
+        wrapped = slots[pos == 0]
+        if len(wrapped):
+            self._resync(wrapped)
+
+    def push_block(self, slot, samples):
+        """Ajoute un bloc (n, C) d'échantillons successifs d'un seul device."""
+        samples = np.asarray(samples, dtype=np.float64)
+        W = self.window_size
+        if len(samples) >= W:
+            # Toute la fenêtre est remplacée : recalcul direct
+            self._ring[slot] = samples[-W:]
+            self._pos[slot] = 0
+            self._resync(np.array([slot]))
+            return
+        for sample in samples:
+            self.push([slot], sample[None])
+
+    def window(self, slots):
+        """Fenêtres (len(slots), window_size, C) dans l'ordre chronologique."""
+        slots = np.asarray(slots, dtype=np.int64)
+        order = (self._pos[slots, None] + np.arange(self.window_size)[None, :]) % self.window_size
+        return self._ring[slots[:, None], order]
+
+    def _resync(self, slots):
+        """Recalcule exactement l'état glissant des devices `slots` depuis leur fenêtre."""
+        x = self.window(slots)
+        W, G = self.window_size, self.n_sensors
+        diff = np.diff(x, axis=1)
+        sign = np.sign(x)
+        self._sum[slots] = x.sum(axis=1)
+        self._sumsq[slots] = (x * x).sum(axis=1)
+        self._jerk[slots] = np.abs(diff).sum(axis=1)
+        self._zc[slots] = (sign[:, 1:] * sign[:, :-1] < 0).sum(axis=1)
+        self._norm[slots] = np.linalg.norm(x[:, :, :3 * G].reshape(len(slots), W, G, 3), axis=3).sum(axis=1)
+        self._dft[slots] = np.fft.rfft(x, axis=1)[:, 1:self.n_bins + 1]
+
+    def features(self, slots):
+        """Vecteurs de caractéristiques (len(slots), F) float32 des fenêtres courantes."""
+        slots = np.asarray(slots, dtype=np.int64)
+        W = self.window_size
+        ring = self._ring[slots]
+        mean = self._sum[slots] / W
+        std = np.sqrt(np.maximum(self._sumsq[slots] / W - mean * mean, 0.0))
+        return np.concatenate([
+            mean,
+            std,
+            ring.min(axis=1),
+            ring.max(axis=1),
+            self._jerk[slots] / (W - 1),
+            self._zc[slots] / (W - 1),
+            self._norm[slots] / W,
+            _band_energy(self._dft[slots], self.edges, W),
+        ], axis=1).astype(np.float32)
@@ -0,0 +1,205 @@
+"""
+Inférence hors de la boucle asyncio.
+
+process_window() appelle le modèle de façon synchrone : branché tel quel
+dans websocket_endpoint ou ws_bridge, il bloquerait toute l'ingestion le
+temps de la prédiction. AsyncInferenceStage envoie les fenêtres à un pool de
+threads (ou de processus) :
+
+- au plus `max_in_flight` prédictions en cours à la fois ;
+- au-delà, on ne garde que la fenêtre la plus récente de chaque clé
+  (deviceId) : les fenêtres périmées sont abandonnées (leur future vaut None) ;
+- chaque submit() retourne une future asyncio, et results() permet de
+  consommer les résultats sous forme de flux (les résultats ne sont gardés
+  pour le flux qu'une fois results() lancé, et au plus `max_results` : au-delà,
+  le plus ancien est jeté) ;
+- stats() distingue le temps d'attente (soumission → début du calcul) du
+  temps de calcul.
+
+Exemple avec un SensorBuffer :
+
+    stage = AsyncInferenceStage(model.predict)
+    buf = SensorBuffer(60, 10, 9, on_window=lambda w: stage.submit(w[None], key=device_id))
+"""
+
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from instruments import counter, histogram
+
+queue_wait_time = histogram("inference.queue_wait")
+compute_time = histogram("inference.compute")
+dropped_windows = counter("inference.dropped")
+
+# Résultats gardés pour results() en attendant d'être lus
+RESULTS_QUEUE_SIZE = 1024
+
+
+def _timed_call(predict, window):
+    # Exécuté dans le pool. time.monotonic() est commun à tous les processus
+    # de la machine, contrairement à perf_counter() selon les plateformes.
+    start = time.monotonic()
+    result = predict(window)
+    return result, start, time.monotonic()
+
+
+class _Timing:
+    """Somme, maximum et dernière valeur d'une durée (en secondes)."""
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self) -> dict:
+        mean = self.total / self.count if self.count else 0.0
+        return {"mean_ms": mean * 1000.0, "max_ms": self.max * 1000.0, "last_ms": self.last * 1000.0}
+
+
+class AsyncInferenceStage:
+    """Étage d'inférence asynchrone à nombre de requêtes en vol borné."""
+
+    def __init__(self, predict, max_in_flight=1, executor=None, use_processes=False, max_workers=None,
+                 max_results=RESULTS_QUEUE_SIZE):
+        """
+        `predict(window)` est appelé dans le pool. Avec use_processes=True,
+        predict doit pouvoir être picklé (fonction de module, objet modèle...).
+        """
+        self.predict = predict
+        self.max_in_flight = max_in_flight
+        self._own_executor = executor is None
+        if executor is None:
+            workers = max_workers or max_in_flight
+            executor = ProcessPoolExecutor(workers) if use_processes else ThreadPoolExecutor(workers)
+        self.executor = executor
+
+        self.in_flight = 0
+        # clé -> (fenêtre, future, instant de soumission) ; la plus récente uniquement
+        self._pending = {}
+        # File du flux results(), créée au premier appel de results()
+        self._results = None
+        self.max_results = max_results
+
+        # Statistiques
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.dropped_results = 0
+        self.errors = 0
+        self.wait = _Timing()
+        self.compute = _Timing()
+
+    def submit(self, window, key=None) -> asyncio.Future:
+        """
+        Soumet une fenêtre (copiée : le buffer d'origine peut continuer à
+        écrire). Ne bloque jamais. La future reçoit le résultat, ou None si
+        la fenêtre a été abandonnée au profit d'une plus récente ; elle est
+        annulée si l'étage est fermé avant le calcul.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        window = np.array(window, copy=True)
+        submitted_at = time.monotonic()
+        self.submitted += 1
+
+        if self.in_flight < self.max_in_flight:
+            self._start(key, window, future, submitted_at)
+        else:
+            stale = self._pending.pop(key, None)
+            if stale is not None:
+                self.dropped += 1
+                dropped_windows.inc()
+                if not stale[1].done():
+                    stale[1].set_result(None)
+            self._pending[key] = (window, future, submitted_at)
+        return future
+
+    def _start(self, key, window, future, submitted_at):
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(self.executor, _timed_call, self.predict, window)
+        job.add_done_callback(lambda j: self._finish(key, j, future, submitted_at))
+
+    def _finish(self, key, job, future, submitted_at):
+        self.in_flight -= 1
+        if job.cancelled():
+            # Exécuteur arrêté avec cancel_futures=True (close()) : la fenêtre
+            # ne sera jamais calculée, ni celles en attente
+            future.cancel()
+            self._cancel_pending()
+            return
+        try:
+            result, started, ended = job.result()
+            self.wait.add(max(0.0, started - submitted_at))
+            self.compute.add(ended - started)
+            queue_wait_time.record(max(0.0, started - submitted_at))
+            compute_time.record(ended - started)
+            self.completed += 1
+            if not future.done():
+                future.set_result(result)
+            self._publish(key, result)
+        except Exception as e:
+            self.errors += 1
+            print(f"[ML Error] Erreur lors de la prédiction: {e}")
+            if not future.done():
+                future.set_result(None)
+
+        # Place libre : on lance la fenêtre en attente la plus ancienne
+        if self._pending and self.in_flight < self.max_in_flight:
+            next_key = next(iter(self._pending))
+            window, next_future, next_submitted = self._pending.pop(next_key)
+            self._start(next_key, window, next_future, next_submitted)
+
+    def _publish(self, key, result):
+        if self._results is None:
+            return
+        if self._results.full():
+            # Lecteur du flux trop lent : on jette le résultat le plus ancien
+            self._results.get_nowait()
+            self.dropped_results += 1
+        self._results.put_nowait((key, result))
+
+    async def results(self):
+        """
+        Flux des résultats (clé, résultat), dans l'ordre de fin de calcul,
+        à partir du premier appel.
+        """
+        if self._results is None:
+            self._results = asyncio.Queue(self.max_results)
+        while True:
+            yield await self._results.get()
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "dropped": self.dropped,
+            "dropped_results": self.dropped_results,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "pending": len(self._pending),
+            "queue_wait": self.wait.summary(),
+            "compute": self.compute.summary(),
+        }
+
+    def _cancel_pending(self):
+        for _, future, _ in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def close(self):
+        self._cancel_pending()
+        if self._own_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,66 @@
+"""
+Compteurs et histogrammes des modules de models/, sans dépendance au serveur.
+
+buffer.py et inference.py déclarent leurs métriques ici, par nom. Tant
+qu'aucun registre n'est branché, elles ne mesurent rien. Le processus hôte
+branche le sien (server/metrics.py, ou tout objet qui fournit counter(name),
+histogram(name), DEBUG et sampled(key)) :
+
+    import metrics, instruments
+    instruments.set_registry(metrics)
+
+Les temps d'inférence apparaissent alors dans metrics.snapshot() (GET
+/metrics) avec les autres métriques du processus.
+"""
+
+_registry = None
+_metrics = []
+
+
+class _Metric:
+    """Compteur ou histogramme nommé, relayé vers le registre branché."""
+    __slots__ = ("name", "kind", "target")
+
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.target = None
+
+    def inc(self, n: int = 1):
+        if self.target is not None:
+            self.target.inc(n)
+
+    def record(self, seconds: float):
+        if self.target is not None:
+            self.target.record(seconds)
+
+    def bind(self, registry):
+        self.target = getattr(registry, self.kind)(self.name) if registry is not None else None
+
+
+def _declare(name: str, kind: str) -> _Metric:
+    metric = _Metric(name, kind)
+    metric.bind(_registry)
+    _metrics.append(metric)
+    return metric
+
+
+def counter(name: str) -> _Metric:
+    return _declare(name, "counter")
+
+
+def histogram(name: str) -> _Metric:
+    return _declare(name, "histogram")
+
+
+def set_registry(registry):
+    """Branche (ou débranche, avec None) le registre de métriques du processus."""
+    global _registry
+    _registry = registry
+    for metric in _metrics:
+        metric.bind(registry)
+
+
+def debug_sampled(key: str) -> bool:
+    """Vrai si le registre est en mode debug et que cet appel est échantillonné."""
+    return _registry is not None and _registry.DEBUG and _registry.sampled(key)
@@ -0,0 +1,114 @@
+"""
+Registre des modèles : un seul chargement par processus, partagé par tous
+les SensorBuffer / SensorBufferPool.
+
+Formats supportés (selon le chemin donné à load_model) :
+- None              : PlaceholderModel (prédit toujours 10, en attendant un vrai modèle)
+- .joblib / .pkl    : joblib.load(path, mmap_mode=...) ; les gros tableaux
+                      NumPy du modèle sont mappés en mémoire
+- dossier           : modèle linéaire W.npy (features, classes) + b.npy (classes),
+                      ouverts avec np.load(mmap_mode=...)
+- .npz              : même modèle linéaire, clés "W" et "b" (chargé en mémoire :
+                      np.load ne sait pas mapper un .npz)
+
+Avec mmap_mode="r", les processus qui chargent le même fichier partagent les
+pages du cache système au lieu d'avoir chacun leur copie des poids.
+
+Au chargement, une prédiction de warm-up sur une fenêtre nulle est faite pour
+que la première vraie fenêtre ne paie pas les allocations / compilations
+paresseuses du modèle. Temps de chargement et de première inférence sont
+affichés et conservés dans model_stats().
+"""
+
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+class PlaceholderModel:
+    """Tient la place du vrai modèle : prédit 10 pour chaque fenêtre du batch."""
+
+    def predict(self, batch):
+        return np.full(len(batch), 10)
+
+
+class LinearModel:
+    """Classifieur linéaire sur la fenêtre aplatie : argmax(x @ W + b)."""
+
+    def __init__(self, W, b):
+        self.W = W
+        self.b = b
+
+    def predict(self, batch):
+        x = np.asarray(batch, dtype=np.float32).reshape(len(batch), -1)
+        return np.argmax(x @ self.W + self.b, axis=1)
+
+
+_models = {}
+_warmed = set()
+_stats = {}
+_lock = threading.Lock()
+
+
+def _load(path, mmap_mode):
+    if path is None:
+        return PlaceholderModel()
+
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(path)
+    if path.is_dir():
+        return LinearModel(
+            np.load(path / "W.npy", mmap_mode=mmap_mode),
+            np.load(path / "b.npy", mmap_mode=mmap_mode),
+        )
+    if path.suffix == ".npz":
+        with np.load(path) as f:
+            return LinearModel(f["W"], f["b"])
+    if path.suffix in (".joblib", ".pkl"):
+        try:
+            import joblib
+        except ImportError as e:
+            raise ImportError("joblib est nécessaire pour charger un modèle .joblib/.pkl (pip install joblib)") from e
+        return joblib.load(path, mmap_mode=mmap_mode)
+    raise ValueError(f"Format de modèle non supporté: {path}")
+
+
+def _key(path, mmap_mode):
+    return (str(Path(path).resolve()) if path is not None else None, mmap_mode)
+
+
+def load_model(path=None, mmap_mode="r", warmup_shape=None):
+    """
+    Retourne le modèle `path`, chargé une seule fois par processus.
+    `warmup_shape` : forme d'une fenêtre (window_size, num_features) ; une
+    prédiction de warm-up est faite une fois par forme.
+    """
+    key = _key(path, mmap_mode)
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            start = time.perf_counter()
+            model = _load(path, mmap_mode)
+            load_ms = (time.perf_counter() - start) * 1000.0
+            _models[key] = model
+            _stats[key] = {"path": key[0], "load_ms": load_ms, "warmup_ms": {}}
+            print(f"[Registry] Modèle '{path or 'placeholder'}' chargé en {load_ms:.2f} ms")
+
+        if warmup_shape is not None and (key, tuple(warmup_shape)) not in _warmed:
+            _warmed.add((key, tuple(warmup_shape)))
+            dummy = np.zeros((1,) + tuple(warmup_shape), dtype=np.float32)
+            start = time.perf_counter()
+            model.predict(dummy)
+            warmup_ms = (time.perf_counter() - start) * 1000.0
+            _stats[key]["warmup_ms"][str(tuple(warmup_shape))] = warmup_ms
+            print(f"[Registry] Première inférence (warm-up {tuple(warmup_shape)}) : {warmup_ms:.2f} ms")
+    return model
+
+
+def model_stats() -> list:
+    """Temps de chargement et de warm-up de chaque modèle chargé dans ce processus."""
+    with _lock:
+        return [dict(s, warmup_ms=dict(s["warmup_ms"])) for s in _stats.values()]
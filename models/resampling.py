@@ -0,0 +1,215 @@
+"""
+Rééchantillonnage des capteurs sur une grille de temps fixe.
+
+Accéléromètre, gyroscope et orientation n'arrivent ni aux mêmes instants ni
+en même nombre (une soixantaine à plus de 120 échantillons par mouvement
+selon le téléphone). Plutôt que de tronquer et de compléter avec des vides,
+on interpole linéairement chaque capteur sur une grille commune à partir
+des temps `t` de tous ses échantillons.
+
+Les angles d'orientation alpha (cap, [0, 360[) et beta ([-180, 180[) sont
+circulaires : ils sont déroulés avant l'interpolation (359 -> 1 passe par
+360, pas par 180) puis ramenés dans leur intervalle (voir ANGLE_RANGES).
+
+Le même noyau, interp_rows(), sert :
+- hors ligne : resample_series() / resample_tensors() sur les échantillons
+  de data_preprocessing.py ;
+- en direct : StreamResampler, utilisé par SensorBuffer.add_timed().
+Les entrées du modèle sont donc construites de la même façon à
+l'entraînement et en production.
+"""
+
+import numpy as np
+
+DEFAULT_STEPS = 60
+DEFAULT_DURATION_MS = 1000.0
+
+# Intervalles des canaux circulaires de chaque capteur (NaN = canal linéaire),
+# dans l'ordre accéléromètre, gyroscope, orientation, magnétomètre, gravité
+ORIENTATION_SENSOR = 2
+ANGLE_RANGES = ((0.0, 360.0), (-180.0, 180.0), (np.nan, np.nan))
+
+
+def sensor_ranges(n_sensors):
+    """Intervalles (n_sensors, 3, 2) des canaux de chaque capteur (NaN = linéaire)."""
+    ranges = np.full((n_sensors, 3, 2), np.nan)
+    if n_sensors > ORIENTATION_SENSOR:
+        ranges[ORIENTATION_SENSOR] = ANGLE_RANGES
+    return ranges
+
+
+def channel_ranges(num_features):
+    """Intervalles (num_features, 2) des canaux d'un échantillon à plat (ax, ay, az, gx...)."""
+    return sensor_ranges(-(-num_features // 3)).reshape(-1, 2)[:num_features]
+
+
+def default_grid(n_steps=DEFAULT_STEPS, duration_ms=DEFAULT_DURATION_MS):
+    """Grille de n_steps instants (ms) au milieu de chaque pas : 8.33, 25, 41.67... pour 60 pas / 1 s."""
+    step = duration_ms / n_steps
+    return ((np.arange(n_steps) + 0.5) * step).astype(np.float32)
+
+
+def _unwrap(values, period):
+    """Déroule sur l'axe 1 les canaux de période `period` (B, C) (NaN = inchangé)."""
+    with np.errstate(invalid="ignore"):
+        jumps = np.round(np.diff(values, axis=1) / period[:, None, :])
+    jumps = np.where(np.isfinite(jumps), jumps, 0.0)
+    values[:, 1:] -= np.cumsum(jumps, axis=1) * np.nan_to_num(period)[:, None, :]
+    return values
+
+
+def _wrap(values, low, period):
+    """Ramène les canaux circulaires dans [low, low + period[ (NaN = inchangé)."""
+    with np.errstate(invalid="ignore"):
+        wrapped = low + np.mod(values - low, period)
+    return np.where(np.isnan(period), values, wrapped)
+
+
+def interp_rows(t, values, lengths, grid, ranges=None):
+    """
+    Interpolation linéaire en lot, comme np.interp ligne par ligne (valeurs
+    maintenues aux bords).
+
+    t       : (B, L) temps des échantillons ; seuls les lengths[b] premiers comptent
+    values  : (B, L, C)
+    lengths : (B,)
+    grid    : (G,) commune ou (B, G) par ligne
+    ranges  : (C, 2) ou (B, C, 2) intervalles [bas, haut[ des canaux circulaires
+              (NaN = linéaire), voir channel_ranges()
+    Retourne (B, G, C) en float32 ; NaN pour les lignes sans échantillon.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float32)
+    lengths = np.asarray(lengths)
+    B, L = t.shape
+    grid = np.broadcast_to(np.asarray(grid, dtype=np.float64), (B, np.shape(grid)[-1]))
+
+    # Échantillons hors longueur (ou sans temps) rejetés en fin de ligne, puis tri par temps
+    valid = (np.arange(L)[None, :] < lengths[:, None]) & ~np.isnan(t)
+    t = np.where(valid, t, np.inf)
+    order = np.argsort(t, axis=1, kind="stable")
+    t = np.take_along_axis(t, order, axis=1)
+    values = np.take_along_axis(values, order[:, :, None], axis=1)
+    n = valid.sum(axis=1)
+
+    if ranges is not None:
+        ranges = np.broadcast_to(np.asarray(ranges, dtype=np.float64), (B, values.shape[2], 2))
+        low = ranges[..., 0]
+        period = ranges[..., 1] - low
+        if not np.isnan(period).all():
+            values = _unwrap(values.astype(np.float64), period)
+
+    # Pour chaque instant de la grille : premier échantillon strictement après
+    idx = (t[:, None, :] <= grid[:, :, None]).sum(axis=2)
+    hi = np.clip(idx, 1, np.maximum(n - 1, 1)[:, None])
+    lo = hi - 1
+    t_lo = np.take_along_axis(t, lo, axis=1)
+    t_hi = np.take_along_axis(t, hi, axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # inf - inf sur les lignes trop courtes : neutralisé par le test isfinite
+        span = t_hi - t_lo
+        w = np.where(np.isfinite(span) & (span > 0), (grid - t_lo) / span, 0.0)
+    w = np.clip(w, 0.0, 1.0)[:, :, None].astype(np.float32)
+
+    v_lo = np.take_along_axis(values, lo[:, :, None], axis=1)
+    v_hi = np.take_along_axis(values, hi[:, :, None], axis=1)
+    # Une ligne à un seul échantillon : valeur constante
+    v_hi = np.where((n == 1)[:, None, None], v_lo, v_hi)
+    out = v_lo + w * (v_hi - v_lo)
+    if ranges is not None and not np.isnan(period).all():
+        out = _wrap(out, low[:, None, :], period[:, None, :]).astype(np.float32)
+    out[n == 0] = np.nan
+    return out
+
+
+def resample_series(T, V, lengths, grid=None):
+    """
+    Rééchantillonne des séries de longueur quelconque, capteur par capteur.
+
+    T       : (n, n_sensors, L) temps (ms) de chaque échantillon
+    V       : (n, n_sensors, L, 3) valeurs
+    lengths : (n, n_sensors) échantillons valides par capteur
+    Retourne (n, len(grid), 3 * n_sensors), tous les capteurs alignés sur la grille.
+    """
+    if grid is None:
+        grid = default_grid()
+    n, n_sensors, L = np.shape(T)
+    ranges = np.broadcast_to(sensor_ranges(n_sensors)[None], (n, n_sensors, 3, 2)).reshape(n * n_sensors, 3, 2)
+    # Un lot de n * n_sensors séries de 3 canaux, interpolées en un seul appel
+    out = interp_rows(
+        np.asarray(T).reshape(n * n_sensors, L),
+        np.asarray(V).reshape(n * n_sensors, L, 3),
+        np.asarray(lengths).reshape(-1),
+        grid,
+        ranges,
+    )
+    return out.reshape(n, n_sensors, len(grid), 3).transpose(0, 2, 1, 3).reshape(n, len(grid), 3 * n_sensors)
+
+
+def resample_tensors(X, T, lengths, grid=None):
+    """
+    Rééchantillonne les tenseurs de data_preprocessing.py.
+
+    X       : (n, steps, 3 * n_sensors) valeurs, capteur par capteur
+    T       : (n, n_sensors, steps) temps (ms) de chaque échantillon
+    lengths : (n, n_sensors) échantillons valides par capteur
+    Retourne (n, len(grid), 3 * n_sensors), tous les capteurs alignés sur la grille.
+    """
+    n, steps, n_features = X.shape
+    n_sensors = n_features // 3
+    V = np.asarray(X).reshape(n, steps, n_sensors, 3).transpose(0, 2, 1, 3)
+    return resample_series(T, V, lengths, grid)
+
+
+class StreamResampler:
+    """
+    Version en flux : reçoit des échantillons horodatés (ms) à cadence
+    irrégulière et produit les échantillons de la grille fixe (rate_hz)
+    situés entre l'échantillon précédent et le nouveau. Les canaux sont ceux
+    d'un échantillon à plat (ax, ay, az, gx, gy, gz, alpha, beta, gamma...) :
+    alpha et beta sont interpolés par le plus court chemin (channel_ranges()).
+    """
+
+    def __init__(self, rate_hz, num_features, max_gap_ms=500.0):
+        self.period = 1000.0 / rate_hz
+        self.num_features = num_features
+        self.ranges = channel_ranges(num_features)
+        # Au-delà de cet écart entre deux échantillons, on n'interpole pas le trou
+        self.max_gap = max_gap_ms
+        self._t = None
+        self._sample = None
+        self._next = None   # prochain instant de la grille à produire
+
+    def push(self, t_ms, sample):
+        """Retourne un tableau (k, num_features) des points de grille dans ]t_précédent, t_ms]."""
+        sample = np.asarray(sample, dtype=np.float32)
+        empty = np.empty((0, self.num_features), dtype=np.float32)
+
+        if self._t is None or t_ms - self._t > self.max_gap:
+            # Premier échantillon (ou reprise après un trou) : la grille repart
+            # d'ici, au milieu des pas comme default_grid() (t0 + 8.33 ms à 60 Hz),
+            # pour que fenêtres en direct et hors ligne tombent aux mêmes instants
+            self._t, self._sample = t_ms, sample
+            self._next = t_ms + 0.5 * self.period
+            return empty
+        if t_ms <= self._t:
+            # Doublon ou échantillon en retard : ignoré
+            return empty
+
+        k = int(np.floor((t_ms - self._next) / self.period)) + 1
+        if k <= 0:
+            self._t, self._sample = t_ms, sample
+            return empty
+
+        grid = self._next + self.period * np.arange(k)
+        out = interp_rows(
+            np.array([[self._t, t_ms]]),
+            np.stack((self._sample, sample))[None],
+            np.array([2]),
+            grid,
+            self.ranges,
+        )[0]
+        self._next = grid[-1] + self.period
+        self._t, self._sample = t_ms, sample
+        return out
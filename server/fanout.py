@@ -0,0 +1,265 @@
+"""
+Files d'envoi par receiver.
+
+Chaque receiver possède une file bornée, vidée par sa propre tâche d'envoi :
+la boucle de réception d'une source ne fait que déposer le message dans les
+files (opération non bloquante), un receiver lent ne ralentit donc plus ni
+les sources ni les autres receivers.
+
+Quand la file d'un receiver est pleine, la politique de débordement choisie
+s'applique :
+- "drop_oldest" : on jette le message le plus ancien de la file
+- "coalesce"    : on remplace le message en attente du même device par le
+                  plus récent (à défaut, on jette le plus ancien)
+- "disconnect"  : on déconnecte le receiver
+
+En mode agrégation (batch_ms > 0), la tâche d'envoi regroupe tous les
+messages arrivés pendant un tick en un seul message (voir encode_batch dans
+protocol.py). Les ticks sont alignés sur une grille de période batch_ms, ce
+qui permet de caler l'envoi sur un bloc audio (ex: 256 / 48000 s = 5.333 ms).
+La latence ajoutée est bornée par la durée d'un tick.
+
+Un receiver peut aussi s'abonner à une partie du flux (devices, capteurs,
+cadence maximale, bande morte, voir subscription.py) : le filtrage est fait
+dans offer(), avant la mise en file et la sérialisation.
+"""
+
+import asyncio
+import collections
+import math
+import time
+
+from fastapi import WebSocket
+
+from metrics import counter, histogram
+from protocol import MAX_BATCH, SourcePacket, check_frame, encode_batch, encode_batch_text
+from subscription import Subscription
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+# Code de fermeture WebSocket "Try Again Later"
+CLOSE_CODE_OVERLOADED = 1013
+
+# Totaux tous receivers confondus (voir GET /metrics)
+sent_total = counter("fanout.sent")
+dropped_total = counter("fanout.dropped")
+filtered_total = counter("fanout.filtered")
+send_time = histogram("fanout.send")
+
+
+def packet_device_id(packet: SourcePacket):
+    """Identifiant du device d'un message, ou None s'il est illisible."""
+    try:
+        return packet.frame.device_id
+    except Exception:
+        return None
+
+
+class ReceiverChannel:
+    """File d'envoi bornée d'un receiver et ses compteurs."""
+
+    def __init__(self, websocket: WebSocket, fmt: str = "json",
+                 maxsize: int = 256, policy: str = "drop_oldest",
+                 batch_ms: float = 0.0, subscription: Subscription = None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Politique de débordement inconnue: {policy}")
+        if maxsize < 1:
+            raise ValueError("La taille de file doit être >= 1")
+        if batch_ms < 0:
+            raise ValueError("batch_ms doit être >= 0")
+
+        self.websocket = websocket
+        self.format = fmt
+        self.maxsize = maxsize
+        self.policy = policy
+        # Période d'agrégation en secondes (0 = un message par trame)
+        self.batch_interval = batch_ms / 1000.0
+        self.subscription = None
+        self.subscribe(subscription)
+
+        self.queue = collections.deque()
+        self.closed = False
+        self.task = None
+        self._ready = asyncio.Event()
+
+        # Compteurs
+        self.enqueued = 0
+        self.sent = 0
+        self.batches = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.filtered = 0
+        self.max_depth = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def subscribe(self, subscription: Subscription = None):
+        """Remplace l'abonnement du receiver (None = tout le flux)."""
+        if subscription is not None and subscription.passthrough:
+            subscription = None
+        self.subscription = subscription
+
+    def offer(self, packet: SourcePacket) -> bool:
+        """
+        Dépose un message dans la file sans jamais attendre.
+        Retourne False si le message n'a pas été accepté.
+        """
+        if self.closed:
+            return False
+
+        if self.subscription is not None:
+            try:
+                packet = self.subscription.filter(packet)
+            except Exception:
+                # Message source illisible : ignoré
+                self.invalid += 1
+                return False
+            if packet is None:
+                self.filtered += 1
+                filtered_total.inc()
+                return False
+
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            dropped_total.inc()
+            if self.policy == "disconnect":
+                print(f"[FANOUT] Receiver saturé ({self.maxsize} messages en attente) : déconnexion.")
+                self.close(CLOSE_CODE_OVERLOADED)
+                return False
+            if not (self.policy == "coalesce" and self._coalesce(packet)):
+                self.queue.popleft()
+
+        self.queue.append(packet)
+        self.enqueued += 1
+        if len(self.queue) > self.max_depth:
+            self.max_depth = len(self.queue)
+        self._ready.set()
+        return True
+
+    def _coalesce(self, packet: SourcePacket) -> bool:
+        """Retire de la file le message en attente du même device, s'il existe."""
+        device_id = packet_device_id(packet)
+        if device_id is None:
+            return False
+        for i, queued in enumerate(self.queue):
+            if packet_device_id(queued) == device_id:
+                del self.queue[i]
+                return True
+        return False
+
+    def _payload(self, packet: SourcePacket):
+        if self.format != "binary":
+            return packet.as_text()
+        payload = packet.as_bytes()
+        # Une trame invalide ne doit pas entrer dans un lot avec celles des autres devices
+        check_frame(payload)
+        return payload
+
+    async def _send(self, payload):
+        start = time.perf_counter()
+        if isinstance(payload, bytes):
+            await self.websocket.send_bytes(payload)
+        else:
+            await self.websocket.send_text(payload)
+        send_time.record(time.perf_counter() - start)
+
+    async def run(self):
+        """Tâche d'envoi : vide la file vers le WebSocket du receiver."""
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                if self.batch_interval:
+                    await self._send_batch()
+                    continue
+
+                packet = self.queue.popleft()
+                try:
+                    payload = self._payload(packet)
+                except Exception:
+                    # Message source illisible : ignoré
+                    self.invalid += 1
+                    continue
+
+                await self._send(payload)
+                self.sent += 1
+                sent_total.inc()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Receiver déconnecté pendant un envoi
+            print(f"[FANOUT] Envoi vers un receiver interrompu : {e}")
+        finally:
+            self.closed = True
+            self.queue.clear()
+
+    async def _send_batch(self):
+        """Attend la fin du tick courant puis envoie toute la file en un lot."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        tick_end = math.ceil(now / self.batch_interval) * self.batch_interval
+        if tick_end > now:
+            await asyncio.sleep(tick_end - now)
+        if self.closed:
+            return
+
+        payloads = []
+        while self.queue and len(payloads) < MAX_BATCH:
+            packet = self.queue.popleft()
+            try:
+                payloads.append(self._payload(packet))
+            except Exception:
+                self.invalid += 1
+        if not payloads:
+            return
+
+        if self.format == "binary":
+            await self._send(encode_batch(payloads))
+        else:
+            await self._send(encode_batch_text(payloads))
+        self.sent += len(payloads)
+        sent_total.inc(len(payloads))
+        self.batches += 1
+
+    def close(self, code: int = 1000):
+        """Arrête la tâche d'envoi et ferme la connexion du receiver."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._ready.set()
+        asyncio.create_task(self._close_websocket(code))
+
+    async def _close_websocket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def stop(self):
+        """Arrêt sans fermer la connexion (le client est déjà parti)."""
+        self.closed = True
+        self.queue.clear()
+        if self.task is not None:
+            self.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "format": self.format,
+            "policy": self.policy,
+            "queue_size": self.maxsize,
+            "batch_ms": self.batch_interval * 1000.0,
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+            "filtered": self.filtered,
+            "subscription": self.subscription.stats() if self.subscription is not None else None,
+        }
@@ -0,0 +1,172 @@
+"""
+Ingestion multi-processus.
+
+Avec `python main.py --workers N`, le serveur principal lance N processus
+d'ingestion, chacun avec son propre serveur WebSocket (port principal + 1 + i).
+Chaque téléphone est affecté à un worker selon son deviceId (hash stable) :
+la page client demande son worker via GET /ingest?deviceId=... puis s'y
+connecte directement. Réception WebSocket, décodage JSON et normalisation en
+trame binaire se font donc sur N cœurs au lieu d'un seul.
+
+Les workers publient les trames binaires sur un bus local (datagrammes UDP
+sur la boucle locale, un datagramme par trame). Le processus principal
+s'abonne au bus et redistribue le flux fusionné à ses receivers via son
+ConnectionManager : pour les receivers, rien ne change.
+"""
+
+import asyncio
+import multiprocessing
+import socket
+import time
+import zlib
+
+import uvicorn
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+
+import metrics
+from metrics import counter, histogram
+from protocol import SourcePacket, check_frame
+
+# Adresse du bus local (le processus principal écoute, les workers publient)
+BUS_HOST = "127.0.0.1"
+BUS_PORT = 8100
+# Tampon de réception du bus : absorbe les rafales sans perdre de datagrammes
+BUS_RCVBUF = 4 * 1024 * 1024
+
+
+def worker_index(device_id: str, n_workers: int) -> int:
+    """Worker attitré d'un device (hash stable entre processus et redémarrages)."""
+    return zlib.crc32(str(device_id).encode("utf-8")) % n_workers
+
+
+def worker_port(index: int, main_port: int) -> int:
+    return main_port + 1 + index
+
+
+class BusPublisher:
+    """Publie des trames binaires sur le bus local."""
+
+    def __init__(self, host: str = BUS_HOST, port: int = BUS_PORT):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.published = 0
+        self.errors = 0
+
+    def publish(self, frame: bytes):
+        try:
+            self.sock.sendto(frame, self.address)
+            self.published += 1
+        except OSError:
+            # Bus absent (processus principal arrêté) : la trame est perdue
+            self.errors += 1
+
+
+class _BusProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback):
+        self.callback = callback
+        self.received = counter("bus.received")
+        self.invalid = counter("bus.invalid")
+
+    def datagram_received(self, data, addr):
+        self.received.inc()
+        try:
+            check_frame(data)
+        except ValueError:
+            self.invalid.inc()
+            return
+        self.callback(SourcePacket(data=data))
+
+
+async def start_bus_subscriber(callback, host: str = BUS_HOST, port: int = BUS_PORT):
+    """
+    Écoute le bus local et appelle `callback(SourcePacket)` pour chaque trame.
+    Retourne le transport asyncio (à fermer à l'arrêt).
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUS_RCVBUF)
+    sock.bind((host, port))
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _BusProtocol(callback), sock=sock)
+    return transport
+
+
+def create_worker_app(index: int, bus_host: str = BUS_HOST, bus_port: int = BUS_PORT) -> FastAPI:
+    """Application d'un worker : un endpoint /ws réservé aux sources, et ses /metrics."""
+    app = FastAPI()
+    publisher = BusPublisher(bus_host, bus_port)
+    sources = set()
+    received = counter("ingest.messages")
+    invalid = counter("ingest.invalid")
+    ingest_time = histogram("ingest")
+
+    @app.get("/metrics")
+    async def get_metrics():
+        snapshot = metrics.snapshot()
+        snapshot.update(worker=index, sources=len(sources),
+                        bus_published=publisher.published, bus_errors=publisher.errors)
+        return snapshot
+
+    @app.websocket("/ws")
+    async def ingest_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        sources.add(websocket)
+        print(f"[WORKER {index}] Source connectée. (Sources: {len(sources)})")
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+
+                start = time.perf_counter()
+                if message.get("bytes") is not None:
+                    packet = SourcePacket(data=message["bytes"])
+                elif message.get("text") is not None:
+                    packet = SourcePacket(text=message["text"])
+                else:
+                    continue
+                received.inc()
+
+                # Normalise en trame binaire ici, pour que le processus
+                # principal n'ait jamais à parser de JSON
+                try:
+                    if packet.data is not None:
+                        check_frame(packet.data)
+                    publisher.publish(packet.as_bytes())
+                except Exception as e:
+                    invalid.inc()
+                    if metrics.sampled("invalid"):
+                        print(f"[WORKER {index}] Message source invalide ignoré ({invalid.value} au total) : {e}")
+                    continue
+                ingest_time.record(time.perf_counter() - start)
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            print(f"[WORKER {index}] Erreur inattendue dans l'endpoint WS: {e}")
+        finally:
+            sources.discard(websocket)
+            print(f"[WORKER {index}] Source déconnectée. (Sources: {len(sources)})")
+
+    return app
+
+
+def run_worker(index: int, host: str, port: int, bus_host: str, bus_port: int):
+    """Point d'entrée d'un processus worker."""
+    app = create_worker_app(index, bus_host, bus_port)
+    uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+def start_workers(n_workers: int, host: str, main_port: int,
+                  bus_host: str = BUS_HOST, bus_port: int = BUS_PORT) -> list:
+    """Lance les processus d'ingestion ; retourne la liste des Process."""
+    processes = []
+    for i in range(n_workers):
+        p = multiprocessing.Process(
+            target=run_worker,
+            args=(i, host, worker_port(i, main_port), bus_host, bus_port),
+            name=f"mocap-ingest-{i}",
+            daemon=True,
+        )
+        p.start()
+        processes.append(p)
+        print(f"[INGEST] Worker {i} lancé sur le port {worker_port(i, main_port)} (pid {p.pid})")
+    return processes
@@ -0,0 +1,238 @@
+"""
+Suivi des numéros de séquence et tampon de gigue du pont OSC.
+
+SeqTracker tient une table par device (dernier seq reçu + fenêtre des 64
+derniers seq vus) et classe chaque trame :
+- NEW       : nouvelle trame (éventuellement après un trou : `gaps` / `missing`)
+- DUPLICATE : seq déjà reçu
+- LATE      : seq plus ancien que le dernier reçu, pas encore vu (réordonnancement)
+Le client repart de seq = 0 quand la page est rechargée, avec le même
+deviceId : un saut en arrière au-delà de la fenêtre, ou SEQ_RESET_RUN trames
+de suite rejetées (doublons / en retard), sont pris pour un redémarrage et
+réinitialisent le device, au lieu de le rendre muet.
+
+JitterBuffer retient les trames quelques ms et les relâche à intervalles
+réguliers d'après le timestamp du téléphone : la rafale Wi-Fi de 5 trames
+arrivées d'un coup ressort espacée comme au départ du téléphone.
+
+    instant de sortie = timestamp + décalage d'horloge + délai
+
+Le décalage d'horloge (téléphone → pont) est estimé par le minimum glissant
+de (arrivée - timestamp). Le délai vaut `target_delay_ms` ; en mode adaptatif
+il monte si le réseau est plus irrégulier, jusqu'au plus grand de : 3 x la
+gigue mesurée (estimateur RFC 3550) et le pic récent de retard (qui décroît
+de `peak_decay_ms_per_s`), plafonné à `max_delay_ms`, puis redescend.
+Une trame arrivée après son instant de sortie part tout de suite si elle
+reste dans l'ordre (compté dans `late`), sinon elle est jetée (`dropped`).
+"""
+
+import heapq
+
+NEW = 0
+DUPLICATE = 1
+LATE = 2
+
+SEQ_MOD = 1 << 32
+SEQ_WINDOW = 64
+# Saut en arrière au-delà duquel on considère que le device a redémarré
+SEQ_RESET = SEQ_WINDOW
+# Nombre de trames rejetées de suite au-delà duquel le device a redémarré
+# (rechargement de la page peu après le démarrage : seq encore dans la fenêtre)
+SEQ_RESET_RUN = 8
+
+
+def _seq_delta(seq: int, last: int) -> int:
+    """seq - last sur 32 bits, signé (gère le rebouclage de seq)."""
+    d = (seq - last) % SEQ_MOD
+    return d - SEQ_MOD if d >= SEQ_MOD // 2 else d
+
+
+class DeviceSeq:
+    __slots__ = ("last", "seen", "rejected", "received", "gaps", "missing", "duplicates", "late", "resets")
+
+    def __init__(self, seq: int):
+        self.last = seq
+        self.seen = 1        # bit i : seq (last - i) reçu
+        self.rejected = 0    # trames rejetées de suite
+        self.received = 1
+        self.gaps = 0
+        self.missing = 0
+        self.duplicates = 0
+        self.late = 0
+        self.resets = 0
+
+    def stats(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if name not in ("seen", "rejected")}
+
+
+class SeqTracker:
+    """Table des seq par device : détection des trous, doublons et trames en retard."""
+
+    def __init__(self):
+        self.devices = {}
+
+    def observe(self, device_id: str, seq: int) -> int:
+        """Classe la trame (NEW, DUPLICATE ou LATE) et met à jour les compteurs du device."""
+        state = self.devices.get(device_id)
+        if state is None:
+            self.devices[device_id] = DeviceSeq(seq)
+            return NEW
+
+        d = _seq_delta(seq, state.last)
+        if d > 0:
+            if d > 1:
+                state.gaps += 1
+                state.missing += d - 1
+            state.seen = ((state.seen << d) | 1) & ((1 << SEQ_WINDOW) - 1) if d < SEQ_WINDOW else 1
+            state.last = seq
+            state.rejected = 0
+            state.received += 1
+            return NEW
+        if -d >= SEQ_RESET or state.rejected + 1 >= SEQ_RESET_RUN:
+            # Le téléphone a redémarré sa numérotation
+            state.resets += 1
+            state.last = seq
+            state.seen = 1
+            state.rejected = 0
+            state.received += 1
+            return NEW
+
+        state.rejected += 1
+        bit = 1 << -d
+        if state.seen & bit:
+            state.duplicates += 1
+            return DUPLICATE
+        state.seen |= bit
+        # Trame comptée manquante lors du trou : finalement reçue
+        state.missing = max(0, state.missing - 1)
+        state.late += 1
+        state.received += 1
+        return LATE
+
+    def totals(self) -> dict:
+        totals = {"devices": len(self.devices), "received": 0, "gaps": 0, "missing": 0,
+                  "duplicates": 0, "late": 0, "resets": 0}
+        for state in self.devices.values():
+            for name in ("received", "gaps", "missing", "duplicates", "late", "resets"):
+                totals[name] += getattr(state, name)
+        return totals
+
+    def stats(self) -> dict:
+        return {device_id: state.stats() for device_id, state in self.devices.items()}
+
+
+class _DeviceClock:
+    __slots__ = ("offset", "updated", "jitter", "peak", "last_transit", "released_ts")
+
+    def __init__(self, transit: float, now: float):
+        self.offset = transit
+        self.updated = now
+        self.jitter = 0.0
+        self.peak = 0.0
+        self.last_transit = transit
+        self.released_ts = None
+
+
+class JitterBuffer:
+    """Tampon de gigue adaptatif, tous devices confondus (temps en ms)."""
+
+    def __init__(self, target_delay_ms: float = 20.0, adaptive: bool = True,
+                 max_delay_ms: float = 100.0, offset_drift_ms_per_s: float = 1.0,
+                 peak_decay_ms_per_s: float = 2.0):
+        self.target_delay = target_delay_ms
+        self.adaptive = adaptive
+        self.max_delay = max(max_delay_ms, target_delay_ms)
+        # Remontée autorisée du minimum glissant (dérive d'horloge, changement de route)
+        self.offset_drift = offset_drift_ms_per_s / 1000.0
+        self.peak_decay = peak_decay_ms_per_s / 1000.0
+        self._clocks = {}
+        self._heap = []
+        self._counter = 0
+
+        # Statistiques
+        self.buffered = 0
+        self.released = 0
+        self.late = 0
+        self.dropped = 0
+
+    def delay(self, device_id: str) -> float:
+        """Délai de sortie courant du device (ms)."""
+        clock = self._clocks.get(device_id)
+        if clock is None or not self.adaptive:
+            return self.target_delay
+        return min(self.max_delay, max(self.target_delay, 3.0 * clock.jitter, clock.peak))
+
+    def push(self, frame, now_ms: float):
+        """
+        Ajoute une trame (avec timestamp). Retourne la trame si elle doit
+        partir immédiatement (déjà en retard sur son instant de sortie), None sinon.
+        """
+        transit = now_ms - frame.timestamp
+        clock = self._clocks.get(frame.device_id)
+        if clock is None:
+            clock = self._clocks[frame.device_id] = _DeviceClock(transit, now_ms)
+        else:
+            # Minimum glissant du temps de transit, autorisé à remonter lentement
+            elapsed = now_ms - clock.updated
+            clock.offset = min(transit, clock.offset + elapsed * self.offset_drift)
+            clock.updated = now_ms
+            # Pic récent du retard au-delà du minimum, qui décroît lentement
+            clock.peak = max(transit - clock.offset, clock.peak - elapsed * self.peak_decay)
+            # Gigue : variation du temps de transit d'une trame à l'autre (RFC 3550)
+            clock.jitter += (abs(transit - clock.last_transit) - clock.jitter) / 16.0
+            clock.last_transit = transit
+
+        if clock.released_ts is not None and frame.timestamp <= clock.released_ts:
+            # Plus ancienne qu'une trame déjà sortie : la sortir casserait l'ordre
+            self.dropped += 1
+            return None
+
+        due = frame.timestamp + clock.offset + self.delay(frame.device_id)
+        if due <= now_ms:
+            self.late += 1
+            self._release(clock, frame)
+            return frame
+
+        self._counter += 1
+        heapq.heappush(self._heap, (due, self._counter, frame))
+        self.buffered += 1
+        return None
+
+    def _release(self, clock, frame):
+        clock.released_ts = frame.timestamp
+        self.released += 1
+
+    def pop_due(self, now_ms: float) -> list:
+        """Trames dont l'instant de sortie est passé, dans l'ordre de sortie."""
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= now_ms:
+            _, _, frame = heapq.heappop(heap)
+            clock = self._clocks[frame.device_id]
+            if clock.released_ts is not None and frame.timestamp <= clock.released_ts:
+                self.dropped += 1
+                continue
+            self._release(clock, frame)
+            due.append(frame)
+        return due
+
+    def next_due(self):
+        """Prochain instant de sortie (ms), ou None si le tampon est vide."""
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def stats(self) -> dict:
+        return {
+            "target_delay_ms": self.target_delay,
+            "adaptive": self.adaptive,
+            "depth": len(self._heap),
+            "buffered": self.buffered,
+            "released": self.released,
+            "late": self.late,
+            "dropped": self.dropped,
+            "delay_ms": {device_id: self.delay(device_id) for device_id in self._clocks},
+            "jitter_ms": {device_id: clock.jitter for device_id, clock in self._clocks.items()},
+            "peak_ms": {device_id: clock.peak for device_id, clock in self._clocks.items()},
+        }
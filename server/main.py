@@ -1,14 +1,83 @@
+import argparse
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Depends, Request
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 import json
-from typing import Set
+from typing import Dict, Set
 import asyncio
+import time
+
+import metrics
+from metrics import counter, histogram
+from protocol import SourcePacket, check_frame
+from fanout import ReceiverChannel
+from subscription import Subscription
+from ingest_workers import start_bus_subscriber, start_workers, worker_index, worker_port
+from shm_ring import SHM_RING_NAME, ShmRingWriter
+from recorder import DEFAULT_RECORD_DIR, SessionRecorder
+
+# Taille par défaut de la file d'envoi de chaque receiver, et politique
+# appliquée quand elle déborde ('drop_oldest', 'coalesce' ou 'disconnect').
+# Un receiver peut les surcharger via ?queue_size=...&policy=...
+RECEIVER_QUEUE_SIZE = 256
+RECEIVER_OVERFLOW_POLICY = "drop_oldest"
+# Période d'agrégation par défaut des receivers en ms (0 = pas d'agrégation).
+# Un receiver peut la choisir via ?batch_ms=5
+RECEIVER_BATCH_MS = 0.0
+
+# Port du serveur principal et nombre de processus d'ingestion (voir
+# ingest_workers.py). Surchargés par --port / --workers au lancement.
+SERVER_PORT = 8000
+INGEST_WORKERS = 0
+# Nom du segment de mémoire partagée où publier les trames décodées pour les
+# consommateurs locaux (voir shm_ring.py). None = désactivé ; --shm au lancement.
+SHM_RING = None
+# Dossier où enregistrer les sessions (voir recorder.py). None = pas
+# d'enregistrement au lancement (--record) ; POST /record/start le démarre.
+RECORD_DIR = None
+# Taille des blocs écrits sur disque par /upload_csv
+UPLOAD_WRITE_BYTES = 1 << 20
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Les temps d'inférence de models/ sont servis par GET /metrics
+    metrics.bind_models()
+
+    # En mode multi-processus, le flux fusionné des workers arrive par le bus local
+    bus = None
+    if INGEST_WORKERS:
+        bus = await start_bus_subscriber(manager.broadcast)
+        print(f"[INGEST] Abonné au bus local ({INGEST_WORKERS} workers)")
+
+    ring = None
+    if SHM_RING:
+        ring = ShmRingWriter(SHM_RING)
+        manager.add_tap(lambda packet: ring.publish(packet.frame))
+        print(f"[SHM] Trames publiées dans la mémoire partagée '{SHM_RING}'")
+
+    if RECORD_DIR:
+        start_recorder(RECORD_DIR)
+    yield
+    if bus is not None:
+        bus.close()
+    if ring is not None:
+        ring.close()
+    if recorder is not None:
+        await asyncio.to_thread(stop_recorder)
 
 # Initialiser l'application FastAPI
 # L'instance de ConnectionManager sera maintenant gérée par l'application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Métriques du chemin chaud (voir metrics.py et GET /metrics)
+ingest_binary = counter("ingest.binary")
+ingest_json = counter("ingest.json")
+ingest_invalid = counter("ingest.invalid")
+ingest_time = histogram("ingest")
+broadcast_time = histogram("broadcast")
+tap_errors = counter("broadcast.tap_errors")
 
 # --- CLASSE DE GESTION DES CONNEXIONS AMÉLIORÉE ---
 class ConnectionManager:
@@ -20,37 +89,78 @@ class ConnectionManager:
     def __init__(self):
         # Clients qui envoient les données (on ne leur renvoie rien)
         self.source_connections: Set[WebSocket] = set()
-        # Clients qui reçoivent les données (osc_sender.py)
-        self.receiver_connections: Set[WebSocket] = set()
+        # Clients qui reçoivent les données (osc_sender.py), avec leur file d'envoi
+        self.receiver_connections: Dict[WebSocket, ReceiverChannel] = {}
+        # Consommateurs internes appelés pour chaque message (mémoire partagée...)
+        self.taps = []
+
+    async def connect(self, websocket: WebSocket, client_type: str, fmt: str = "json",
+                      queue_size: int = None, policy: str = None, batch_ms: float = None,
+                      subscription: Subscription = None):
+        if client_type not in ("source", "receiver"):
+            # Rejeter ou gérer les types inconnus si nécessaire
+            raise ValueError(f"Type de client inconnu: {client_type}")
+        if fmt not in ("json", "binary"):
+            raise ValueError(f"Format inconnu: {fmt}")
+
+        channel = None
+        if client_type == "receiver":
+            # Valide la configuration avant d'accepter la connexion
+            channel = ReceiverChannel(
+                websocket,
+                fmt,
+                maxsize=queue_size or RECEIVER_QUEUE_SIZE,
+                policy=policy or RECEIVER_OVERFLOW_POLICY,
+                batch_ms=RECEIVER_BATCH_MS if batch_ms is None else batch_ms,
+                subscription=subscription,
+            )
 
-    async def connect(self, websocket: WebSocket, client_type: str):
         await websocket.accept()
-        
+
         if client_type == "source":
             self.source_connections.add(websocket)
-        elif client_type == "receiver":
-            self.receiver_connections.add(websocket)
         else:
-            # Rejeter ou gérer les types inconnus si nécessaire
-            raise ValueError(f"Type de client inconnu: {client_type}")
-
+            self.receiver_connections[websocket] = channel
+            channel.start()
 
     def disconnect(self, websocket: WebSocket):
         self.source_connections.discard(websocket)
-        self.receiver_connections.discard(websocket)
+        channel = self.receiver_connections.pop(websocket, None)
+        if channel is not None:
+            channel.stop()
 
-    async def broadcast(self, message: str):
+    def broadcast(self, packet: SourcePacket):
         """
         Diffuse le message à TOUS les clients 'receiver' (ponts OSC, etc.)
         Cette méthode garantit que les 'source' n'ont pas de trafic inutile.
+        Le message est seulement déposé dans la file de chaque receiver :
+        l'appel ne bloque jamais, même si un receiver est lent.
         """
-        tasks = []
+        start = time.perf_counter()
         # On itère UNIQUEMENT sur les récepteurs
-        for connection in self.receiver_connections:
-            tasks.append(connection.send_text(message))
-            
-        # Exécuter les envois et ignorer les erreurs de déconnexion (return_exceptions=True)
-        await asyncio.gather(*tasks, return_exceptions=True)
+        for channel in list(self.receiver_connections.values()):
+            channel.offer(packet)
+
+        for tap in self.taps:
+            try:
+                tap(packet)
+            except Exception as e:
+                tap_errors.inc()
+                if tap_errors.value == 1 or metrics.sampled("tap_error"):
+                    print(f"[SERVER] Consommateur interne en erreur : {e}")
+        broadcast_time.record(time.perf_counter() - start)
+
+    def add_tap(self, tap):
+        """Ajoute un consommateur interne, appelé (sans attente) pour chaque message."""
+        self.taps.append(tap)
+
+    def remove_tap(self, tap):
+        if tap in self.taps:
+            self.taps.remove(tap)
+
+    def receiver_stats(self) -> list:
+        """Compteurs (profondeur de file, pertes...) de chaque receiver."""
+        return [channel.stats() for channel in self.receiver_connections.values()]
 
 # Création du gestionnaire unique (injection de dépendance)
 manager = ConnectionManager()
@@ -59,42 +169,109 @@ def get_manager():
     """Fonction de dépendance pour l'injection du ConnectionManager."""
     return manager
 
+# Enregistreur de sessions en cours (None = pas d'enregistrement)
+recorder = None
+
+def start_recorder(directory):
+    global recorder
+    if recorder is None:
+        recorder = SessionRecorder(directory)
+        recorder.start()
+        manager.add_tap(recorder.record)
+    return recorder
+
+def stop_recorder():
+    """Arrête l'enregistrement (bloquant : vide la file sur disque)."""
+    global recorder
+    if recorder is None:
+        return None
+    stopped, recorder = recorder, None
+    manager.remove_tap(stopped.record)
+    stopped.stop()
+    return stopped
+
+def update_subscription(websocket: WebSocket, text: str):
+    """Applique un message d'abonnement envoyé par un receiver (les autres messages sont ignorés)."""
+    channel = manager.receiver_connections.get(websocket)
+    try:
+        data = json.loads(text)
+        if channel is None or not isinstance(data, dict) or data.get("type") != "subscribe":
+            return
+        channel.subscribe(Subscription.from_message(data))
+        print(f"[SERVER] Abonnement du receiver mis à jour : {channel.stats()['subscription']}")
+    except (ValueError, TypeError) as e:
+        print(f"[SERVER] Abonnement invalide ignoré : {e}")
+
 # --- Endpoint WebSocket ---
 # Ajout d'un paramètre de requête 'client_type' pour identifier le rôle
 @app.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
     client_type: str = Query(..., min_length=4),  # 'source' ou 'receiver'
+    format: str = Query("json"),  # format voulu par un 'receiver' : 'json' ou 'binary'
+    queue_size: int = Query(None, ge=1),  # taille de la file d'envoi d'un 'receiver'
+    policy: str = Query(None),  # politique de débordement d'un 'receiver'
+    batch_ms: float = Query(None, ge=0),  # période d'agrégation d'un 'receiver' (ms)
+    devices: str = Query(None),  # abonnement d'un 'receiver' : devices voulus ('a,b')
+    sensors: str = Query(None),  # ... capteurs voulus ('accelerometer,gyroscope')
+    max_hz: float = Query(None, ge=0),  # ... cadence maximale par device
+    deadband: float = Query(None, ge=0),  # ... variation minimale pour renvoyer une trame
     manager: ConnectionManager = Depends(get_manager)
 ):
     
     try:
         # Se connecter et identifier le client
-        await manager.connect(websocket, client_type)
+        subscription = Subscription(devices, sensors, max_hz, deadband) if client_type == "receiver" else None
+        await manager.connect(websocket, client_type, format, queue_size, policy, batch_ms, subscription)
         print(f"WebSocket: Client '{client_type}' connecté. (Sources: {len(manager.source_connections)}, Receivers: {len(manager.receiver_connections)})")
         
         # Seul un client de type 'source' doit boucler et envoyer des données
         if client_type == "source":
             while True:
-                # 1. Attendre un message de la SOURCE
-                data = await websocket.receive_text()
-
-                # Traiter et logger
-                try:
-                    # Log de réception
-                    print(f"[SERVER 8000] Reçu data de la source : {data[:50]}...")
-                except Exception:
-                    print("[SERVER 8000] Reçu un message non-texte.")
+                # 1. Attendre un message de la SOURCE (texte JSON ou trame binaire)
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+
+                start = time.perf_counter()
+                if message.get("bytes") is not None:
+                    packet = SourcePacket(data=message["bytes"])
+                    try:
+                        # Relayée telle quelle aux receivers binaires : validée ici
+                        check_frame(packet.data)
+                    except ValueError as e:
+                        ingest_invalid.inc()
+                        if ingest_invalid.value == 1 or metrics.sampled("invalid"):
+                            print(f"[SERVER {SERVER_PORT}] Trame binaire invalide ignorée ({ingest_invalid.value} au total) : {e}")
+                        continue
+                    ingest_binary.inc()
+                    if metrics.DEBUG and metrics.sampled("ingest"):
+                        print(f"[SERVER {SERVER_PORT}] Reçu trame binaire de la source ({len(packet.data)} octets)")
+                elif message.get("text") is not None:
+                    packet = SourcePacket(text=message["text"])
+                    ingest_json.inc()
+                    if metrics.DEBUG and metrics.sampled("ingest"):
+                        print(f"[SERVER {SERVER_PORT}] Reçu data de la source : {packet.text[:50]}...")
+                else:
                     continue
 
                 # 2. DIFFUSER le message à TOUS les 'receivers'
-                await manager.broadcast(data)
+                manager.broadcast(packet)
+                ingest_time.record(time.perf_counter() - start)
                 
         # Les clients 'receiver' attendent simplement d'être déconnectés par le serveur
         # ou ils bouclent côté client (comme osc_sender.py)
         else:
-            # Maintient la connexion ouverte pour que 'osc_sender.py' puisse recevoir le broadcast
-            await websocket.receive_text() 
+            # Maintient la connexion ouverte pour que 'osc_sender.py' puisse recevoir le broadcast.
+            # Les envois sont faits par la tâche de la file du receiver.
+            # Le receiver peut changer d'abonnement en cours de route :
+            # {"type": "subscribe", "devices": [...], "sensors": [...], "max_hz": 30, "deadband": 0.01}
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                if message.get("text"):
+                    update_subscription(websocket, message["text"])
 
 
     except WebSocketDisconnect:
@@ -108,26 +285,77 @@ async def websocket_endpoint(
         print(f"Erreur inattendue dans l'endpoint WS: {e}")
         manager.disconnect(websocket)
 
+# --- Compteurs des files d'envoi ---
+@app.get("/stats")
+async def stats():
+    return {
+        "sources": len(manager.source_connections),
+        "receivers": manager.receiver_stats(),
+        "recorder": recorder.stats() if recorder is not None else None,
+    }
+
+# --- Métriques internes (compteurs, histogrammes de latence) ---
+@app.get("/metrics")
+async def get_metrics():
+    snapshot = metrics.snapshot()
+    snapshot["sources"] = len(manager.source_connections)
+    snapshot["receivers"] = len(manager.receiver_connections)
+    return snapshot
+
+# --- Enregistrement des sessions côté serveur ---
+@app.post("/record/start")
+async def record_start():
+    return start_recorder(RECORD_DIR or DEFAULT_RECORD_DIR).stats()
+
+@app.post("/record/stop")
+async def record_stop():
+    stopped = await asyncio.to_thread(stop_recorder)
+    return stopped.stats() if stopped is not None else {"recording": False}
+
+# --- Affectation d'une source à un worker d'ingestion ---
+@app.get("/ingest")
+async def ingest(deviceId: str):
+    """
+    Indique à une source sur quel port se connecter. Sans workers, la source
+    reste sur le serveur principal (/ws).
+    """
+    if not INGEST_WORKERS:
+        return {"workers": 0}
+    index = worker_index(deviceId, INGEST_WORKERS)
+    return {"workers": INGEST_WORKERS, "worker": index, "port": worker_port(index, SERVER_PORT)}
+
 # --- Endpoint pour recevoir un CSV depuis le navigateur ---
 @app.post("/upload_csv")
 async def upload_csv(request: Request):
     """
     Reçoit un CSV envoyé par le navigateur (depuis le téléphone) et le sauvegarde sur le PC.
+    Le corps est écrit au fil de l'eau, par blocs d'au plus UPLOAD_WRITE_BYTES,
+    depuis un thread : ni le CSV entier en mémoire, ni écriture disque sur la boucle.
     """
+    # Nom du fichier avec timestamp réel
+    from datetime import datetime
+    file_name = f"dataset_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    file_path = Path(file_name)
+    f = None
     try:
-        data = await request.body()  # Contenu brut du CSV
-        ts = asyncio.get_event_loop().time()  # timestamp relatif
-        # Nom du fichier avec timestamp réel
-        from datetime import datetime
-        file_name = f"dataset_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        file_path = Path(file_name)
-
-        file_path.write_bytes(data)
+        f = await asyncio.to_thread(open, file_path, "wb")
+        pending = bytearray()
+        async for chunk in request.stream():
+            pending += chunk
+            if len(pending) >= UPLOAD_WRITE_BYTES:
+                await asyncio.to_thread(f.write, pending)
+                pending = bytearray()
+        if pending:
+            await asyncio.to_thread(f.write, pending)
+        await asyncio.to_thread(f.close)
         print(f"✅ Fichier CSV reçu et sauvegardé sous {file_path.resolve()}")
         return {"status": "ok", "file": file_name}
 
     except Exception as e:
         print(f"❌ Erreur lors de la sauvegarde du CSV : {e}")
+        if f is not None:
+            f.close()
+            file_path.unlink(missing_ok=True)
         return {"status": "error", "detail": str(e)}
 
 
@@ -137,5 +365,26 @@ app.mount("/", StaticFiles(directory=CLIENT_DIR, html=True), name="static")
 
 # Lancer le serveur avec Uvicorn
 if __name__ == "__main__":
-    print("Lancement du serveur web + WebSocket sur http://localhost:8000")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    parser = argparse.ArgumentParser(description="Serveur web + WebSocket mocap")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="nombre de processus d'ingestion des sources (0 = tout dans ce processus)")
+    parser.add_argument("--shm", nargs="?", const=SHM_RING_NAME, default=None, metavar="NAME",
+                        help=f"publier les trames en mémoire partagée (défaut: {SHM_RING_NAME})")
+    parser.add_argument("--log-level", choices=metrics.LOG_LEVELS, default=metrics.LOG_LEVEL,
+                        help="debug : journal échantillonné des messages reçus")
+    parser.add_argument("--record", nargs="?", const=DEFAULT_RECORD_DIR, default=None, metavar="DIR",
+                        help=f"enregistrer les sessions des sources (défaut: {DEFAULT_RECORD_DIR})")
+    args = parser.parse_args()
+
+    SERVER_PORT = args.port
+    INGEST_WORKERS = args.workers
+    SHM_RING = args.shm
+    RECORD_DIR = args.record
+    metrics.set_log_level(args.log_level)
+    if INGEST_WORKERS:
+        start_workers(INGEST_WORKERS, args.host, SERVER_PORT)
+
+    print(f"Lancement du serveur web + WebSocket sur http://localhost:{SERVER_PORT}")
+    uvicorn.run(app, host=args.host, port=SERVER_PORT)
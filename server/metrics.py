@@ -0,0 +1,192 @@
+"""
+Métriques internes à faible coût : compteurs et histogrammes de latence.
+
+Remplace les print() par message du chemin chaud (qui, à 60 Hz par device,
+coûtaient plus cher que le traitement lui-même) :
+
+    from metrics import counter, histogram
+
+    received = counter("ingest.messages")
+    broadcast_time = histogram("ingest.broadcast")
+    ...
+    received.inc()
+    start = time.perf_counter()
+    manager.broadcast(packet)
+    broadcast_time.record(time.perf_counter() - start)
+
+Les histogrammes sont de type HDR : buckets logarithmiques en microsecondes,
+chacun découpé en 2**SUB_BITS sous-buckets (précision relative ~6 %), donc
+un enregistrement = quelques opérations entières, sans allocation, et des
+percentiles p50/p99/p999 fiables quelle que soit la plage de valeurs.
+
+snapshot() donne l'état de toutes les métriques du processus (servi par
+GET /metrics). Les incréments ne prennent pas de verrou : sous charge
+multi-thread, un compte peut exceptionnellement être perdu.
+
+Journal de debug échantillonné : avec MOCAP_LOG_LEVEL=debug (ou
+--log-level debug), `if DEBUG and sampled("ingest"): print(...)` affiche un
+message sur LOG_SAMPLE_EVERY. Au niveau par défaut, le test ne coûte qu'une
+lecture de variable.
+
+Les modules de models/ (SensorBuffer, SensorBufferPool, AsyncInferenceStage)
+déclarent leurs métriques dans models/instruments.py, sans importer ce
+module. Le serveur et le pont OSC appellent bind_models() au démarrage pour
+que ces métriques soient enregistrées ici et servies avec les autres.
+"""
+
+import os
+import sys
+import threading
+import time
+
+SUB_BITS = 4
+SUB_COUNT = 1 << SUB_BITS
+# Jusqu'à 2**(MAX_SHIFT + SUB_BITS + 1) µs (~ 9 heures) ; au-delà, dernier bucket
+MAX_SHIFT = 30
+N_BUCKETS = (MAX_SHIFT + 2) * SUB_COUNT
+
+LOG_LEVELS = ("debug", "info", "warning")
+LOG_LEVEL = os.environ.get("MOCAP_LOG_LEVEL", "info").lower()
+DEBUG = LOG_LEVEL == "debug"
+LOG_SAMPLE_EVERY = int(os.environ.get("MOCAP_LOG_SAMPLE", "100"))
+
+
+def _bucket_index(us: int) -> int:
+    shift = us.bit_length() - SUB_BITS - 1
+    if shift <= 0:
+        return us
+    if shift > MAX_SHIFT:
+        return N_BUCKETS - 1
+    return (shift << SUB_BITS) + (us >> shift)
+
+
+def _bucket_bounds(index: int):
+    """Bornes [basse, haute[ en µs du bucket `index`."""
+    shift = max((index >> SUB_BITS) - 1, 0)
+    top = index - (shift << SUB_BITS)
+    return top << shift, (top + 1) << shift
+
+
+class Counter:
+    __slots__ = ("name", "value")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+
+class Histogram:
+    """Histogramme de durées (enregistrées en secondes, stockées en µs)."""
+    __slots__ = ("name", "counts", "count", "total", "max")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        us = int(seconds * 1e6)
+        if us < 0:
+            us = 0
+        self.counts[_bucket_index(us)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """Percentile q (0-100) en secondes (milieu du bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            if n:
+                seen += n
+                if seen >= rank:
+                    low, high = _bucket_bounds(index)
+                    return min((low + high) / 2e6, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "mean_ms": mean * 1000.0,
+            "p50_ms": self.percentile(50) * 1000.0,
+            "p99_ms": self.percentile(99) * 1000.0,
+            "p999_ms": self.percentile(99.9) * 1000.0,
+            "max_ms": self.max * 1000.0,
+        }
+
+
+_counters = {}
+_histograms = {}
+_samples = {}
+_lock = threading.Lock()
+_started = time.time()
+
+
+def counter(name: str) -> Counter:
+    """Compteur `name` du processus (créé au premier appel, puis partagé)."""
+    c = _counters.get(name)
+    if c is None:
+        with _lock:
+            c = _counters.setdefault(name, Counter(name))
+    return c
+
+
+def histogram(name: str) -> Histogram:
+    """Histogramme `name` du processus (créé au premier appel, puis partagé)."""
+    h = _histograms.get(name)
+    if h is None:
+        with _lock:
+            h = _histograms.setdefault(name, Histogram(name))
+    return h
+
+
+def snapshot() -> dict:
+    """Valeur de tous les compteurs et résumé de tous les histogrammes."""
+    return {
+        "pid": os.getpid(),
+        "uptime_s": time.time() - _started,
+        "counters": {name: c.value for name, c in sorted(_counters.items())},
+        "histograms": {name: h.summary() for name, h in sorted(_histograms.items())},
+    }
+
+
+def set_log_level(level: str):
+    """Change le niveau de journal du processus (et des processus qu'il lancera)."""
+    global LOG_LEVEL, DEBUG
+    level = level.lower()
+    if level not in LOG_LEVELS:
+        raise ValueError(f"Niveau de journal inconnu: {level}")
+    LOG_LEVEL = level
+    DEBUG = level == "debug"
+    os.environ["MOCAP_LOG_LEVEL"] = level
+
+
+def sampled(key: str, every: int = None) -> bool:
+    """Vrai pour un appel sur `every` (LOG_SAMPLE_EVERY par défaut) de la clé `key`."""
+    n = _samples.get(key, 0)
+    _samples[key] = n + 1
+    return n % (every or LOG_SAMPLE_EVERY) == 0
+
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models")
+
+
+def bind_models():
+    """
+    Branche ce registre sur les métriques de models/ (instruments.set_registry).
+    À appeler au démarrage de tout processus qui fait tourner du code de models/.
+    """
+    if MODELS_DIR not in sys.path:
+        sys.path.append(MODELS_DIR)
+    import instruments
+    instruments.set_registry(sys.modules[__name__])
@@ -0,0 +1,148 @@
+"""
+Encodeur OSC rapide pour le pont WS → OSC.
+
+Plutôt que de reconstruire un OscMessage (adresse, typetags, arguments) pour
+chaque capteur de chaque trame, l'encodeur :
+- met en cache, par device, l'adresse et les typetags déjà encodés et
+  paddés sur 4 octets (une seule passe de sanitize_id par device) ;
+- écrit les arguments directement dans un tampon réutilisé (struct.pack_into) ;
+- peut regrouper accéléromètre / gyroscope / orientation d'une trame dans un
+  seul bundle OSC (un seul datagramme UDP par trame).
+
+Les messages produits sont identiques à ceux de SimpleUDPClient.send_message :
+    {base}/{deviceId}/{capteur} [seq] [timestamp] v1 v2 v3
+"""
+
+import re
+import struct
+import time
+
+from protocol import SENSORS
+
+# Capteurs relayés en OSC, dans l'ordre des messages d'un bundle
+OSC_SENSORS = ("accelerometer", "gyroscope", "orientation")
+
+BUNDLE_PREFIX = b"#bundle\x00"
+# Timetag OSC spécial "exécuter immédiatement"
+IMMEDIATE = 1
+# Décalage entre l'époque NTP (1900) et l'époque Unix (1970), en secondes
+NTP_EPOCH_OFFSET = 2208988800
+
+MAX_DATAGRAM = 65507
+
+_TIMETAG = struct.Struct(">Q")
+_SIZE = struct.Struct(">i")
+_INT32_MIN, _INT32_MAX = -(2 ** 31), 2 ** 31 - 1
+
+
+def sanitize_id(device_id: str) -> str:
+    """Nettoie le device_id pour être sûr qu’il soit valide dans une adresse OSC."""
+    if not isinstance(device_id, str):
+        device_id = str(device_id)
+    return re.sub(r'[^A-Za-z0-9_\-]', '_', device_id)
+
+
+def osc_string(value: str) -> bytes:
+    """Chaîne OSC : UTF-8, terminée par au moins un NUL, paddée sur 4 octets."""
+    data = value.encode("utf-8")
+    return data + b"\x00" * (4 - len(data) % 4)
+
+
+def ntp_timetag(t: float = None) -> int:
+    """Timetag OSC (format NTP 32.32) pour l'instant Unix `t` (défaut : maintenant)."""
+    if t is None:
+        t = time.time()
+    return int((t + NTP_EPOCH_OFFSET) * (1 << 32)) & 0xFFFFFFFFFFFFFFFF
+
+
+def _int_tag(value) -> str:
+    # Même choix que python-osc : 'i' si la valeur tient sur 32 bits, sinon 'h'
+    if value is None:
+        return ""
+    return "i" if _INT32_MIN <= value <= _INT32_MAX else "h"
+
+
+_ARG_STRUCTS = {}
+
+
+def _arg_struct(int_tags: str) -> struct.Struct:
+    """Struct des arguments (entiers communs + 3 floats) pour une combinaison de typetags."""
+    s = _ARG_STRUCTS.get(int_tags)
+    if s is None:
+        fmt = ">" + int_tags.replace("h", "q") + "fff"
+        s = _ARG_STRUCTS[int_tags] = struct.Struct(fmt)
+    return s
+
+
+class OscFrameEncoder:
+    """Encode des trames (protocol.Frame) en messages ou bundles OSC."""
+
+    def __init__(self, base: str = "/mocap", sensors=OSC_SENSORS):
+        self.base = base
+        # (bit du capteur dans Frame.mask, ligne dans Frame.values, nom)
+        self._sensors = [(1 << SENSORS.index(name), SENSORS.index(name), name) for name in sensors]
+        # Capteurs relayés : une trame sans aucun de ces bits ne produit rien
+        self.mask = sum(bit for bit, _, _ in self._sensors)
+        # device_id -> {int_tags -> [en-tête adresse+typetags par capteur]}
+        self._heads = {}
+        self._buf = bytearray(MAX_DATAGRAM)
+
+    def _device_heads(self, device_id: str, int_tags: str) -> list:
+        by_tags = self._heads.get(device_id)
+        if by_tags is None:
+            by_tags = self._heads[device_id] = {}
+        heads = by_tags.get(int_tags)
+        if heads is None:
+            sid = sanitize_id(device_id)
+            typetags = osc_string("," + int_tags + "fff")
+            heads = by_tags[int_tags] = [
+                osc_string(f"{self.base}/{sid}/{name}") + typetags
+                for _, _, name in self._sensors
+            ]
+        return heads
+
+    def _prepare(self, frame):
+        """Arguments communs, en-têtes et Struct d'arguments pour une trame."""
+        common = []
+        int_tags = ""
+        if frame.seq is not None:
+            common.append(int(frame.seq))
+            int_tags += _int_tag(common[-1])
+        if frame.timestamp is not None:
+            common.append(int(frame.timestamp))
+            int_tags += _int_tag(common[-1])
+        return common, self._device_heads(frame.device_id, int_tags), _arg_struct(int_tags)
+
+    def _write_message(self, buf, offset: int, head: bytes, args: struct.Struct, values) -> int:
+        end = offset + len(head)
+        buf[offset:end] = head
+        args.pack_into(buf, end, *values)
+        return end + args.size
+
+    def encode_messages(self, frame) -> list:
+        """Un message OSC (bytes) par capteur présent dans la trame."""
+        common, heads, args = self._prepare(frame)
+        rows = frame.values.tolist()
+        messages = []
+        for (bit, row, _), head in zip(self._sensors, heads):
+            if frame.mask & bit:
+                messages.append(head + args.pack(*common, *rows[row]))
+        return messages
+
+    def encode_bundle(self, frame, timetag: int = IMMEDIATE) -> memoryview:
+        """
+        Un seul bundle OSC regroupant les messages de la trame.
+        Le résultat est une vue sur le tampon interne : il doit être envoyé
+        avant l'appel suivant.
+        """
+        common, heads, args = self._prepare(frame)
+        rows = frame.values.tolist()
+        buf = self._buf
+        buf[0:8] = BUNDLE_PREFIX
+        _TIMETAG.pack_into(buf, 8, timetag)
+        offset = 16
+        for (bit, row, _), head in zip(self._sensors, heads):
+            if frame.mask & bit:
+                _SIZE.pack_into(buf, offset, len(head) + args.size)
+                offset = self._write_message(buf, offset + 4, head, args, common + rows[row])
+        return memoryview(buf)[:offset]
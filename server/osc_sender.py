@@ -1,14 +1,27 @@
+import argparse
 import asyncio
-import json
-import re
+import socket
+import struct
+import time
+from urllib.parse import urlencode
 import websockets
-from pythonosc.udp_client import SimpleUDPClient
+
+import metrics
+from metrics import counter, histogram
+from jitter import DUPLICATE, LATE, JitterBuffer, SeqTracker
+from osc_encoder import OscFrameEncoder
+from protocol import decode_message
+from shm_ring import SHM_RING_NAME, ShmRingReader
 
 # -------------------------------------------------------------------
 # 1. CONFIGURATION
 # -------------------------------------------------------------------
 # URI du serveur WebSocket (correspond à /ws?client_type=receiver)
-WS_SERVER_URI = "ws://127.0.0.1:8000/ws?client_type=receiver"
+# format=binary : le serveur relaie les trames binaires compactes (voir protocol.py)
+# Ajouter &batch_ms=5 pour recevoir les trames regroupées par tick de 5 ms,
+# et &max_hz=30&sensors=orientation&deadband=0.5 pour ne recevoir que ce
+# qu'utilise le patch (voir subscription.py, ou --max-hz/--sensors/--deadband)
+WS_SERVER_URI = "ws://127.0.0.1:8000/ws?client_type=receiver&format=binary"
 
 # Destination OSC (par défaut : localhost:9000)
 OSC_IP = "127.0.0.1"
@@ -17,39 +30,132 @@ OSC_PORT = 9000
 # Base des adresses OSC
 OSC_BASE = "/mocap"
 
+# Regroupe les messages d'une trame (accéléromètre, gyroscope, orientation)
+# dans un seul bundle OSC : un datagramme UDP par trame au lieu de trois.
+# Mettre à False si le récepteur OSC ne gère pas les bundles.
+OSC_USE_BUNDLES = True
+
+# Mode mémoire partagée (--shm) : période de scrutation de l'anneau, en ms
+SHM_POLL_MS = 1.0
+
+# Période du résumé des métriques affiché par le pont, en secondes (0 = jamais)
+METRICS_INTERVAL_S = 10.0
+
+# Trames arrivées après une trame plus récente du même device : jetées plutôt
+# que d'envoyer un retour en arrière à VCV Rack (sans tampon de gigue)
+DROP_LATE_FRAMES = True
+
+# Tampon de gigue (voir jitter.py) : délai cible en ms, 0 = désactivé (les
+# trames partent dès réception). En mode adaptatif, le délai monte avec la
+# gigue mesurée, jusqu'à JITTER_MAX_MS.
+JITTER_TARGET_MS = 0.0
+JITTER_ADAPTIVE = True
+JITTER_MAX_MS = 100.0
+# Période de scrutation du tampon de gigue, en ms
+JITTER_TICK_MS = 1.0
+
 # -------------------------------------------------------------------
 # 2. UTILITAIRES
 # -------------------------------------------------------------------
-def sanitize_id(device_id: str) -> str:
-    """Nettoie le device_id pour être sûr qu’il soit valide dans une adresse OSC."""
-    if not isinstance(device_id, str):
-        device_id = str(device_id)
-    return re.sub(r'[^A-Za-z0-9_\-]', '_', device_id)
-
-def safe_float(v, default=0.0):
-    """Convertit en float sans lever d’erreur."""
-    try:
-        return float(v)
-    except Exception:
-        return float(default)
+ws_messages = counter("bridge.ws_messages")
+invalid_messages = counter("bridge.invalid")
+frames_sent = counter("bridge.frames")
+osc_errors = counter("bridge.osc_errors")
+decode_time = histogram("bridge.decode")
+osc_send_time = histogram("bridge.osc_send")
+duplicates_dropped = counter("bridge.seq.duplicates_dropped")
+late_dropped = counter("bridge.seq.late_dropped")
 
-def osc_send(addr: str, common_args: list, extra: list):
+# Table des seq par device, et tampon de gigue (None = désactivé)
+seq_tracker = SeqTracker()
+jitter_buffer = None
+
+def send_frame(frame):
     """
-    Envoie un message OSC en filtrant les None et en gérant les erreurs.
+    Traduit une trame décodée (protocol.Frame) en OSC :
+    {OSC_BASE}/{deviceId}/accelerometer|gyroscope|orientation seq timestamp v1 v2 v3
     """
-    args = [a for a in common_args if a is not None]
-    args.extend(extra)
+    if not frame.mask & osc_encoder.mask:
+        return
+    start = time.perf_counter()
     try:
-        osc_client.send_message(addr, args)
+        if OSC_USE_BUNDLES:
+            osc_socket.sendto(osc_encoder.encode_bundle(frame), osc_address)
+        else:
+            for message in osc_encoder.encode_messages(frame):
+                osc_socket.sendto(message, osc_address)
     except Exception as e:
-        print(f"[ERROR] Envoi OSC vers {addr} échoué : {e}")
+        osc_errors.inc()
+        if osc_errors.value == 1 or metrics.sampled("osc_error"):
+            print(f"[ERROR] Envoi OSC pour {frame.device_id} échoué ({osc_errors.value} au total) : {e}")
+        return
+    osc_send_time.record(time.perf_counter() - start)
+    frames_sent.inc()
+
+def handle_frame(frame):
+    """
+    Contrôle de séquence (doublons, trames en retard), puis envoi OSC direct
+    ou passage par le tampon de gigue.
+    """
+    if frame.seq is not None:
+        status = seq_tracker.observe(frame.device_id, frame.seq)
+        if status == DUPLICATE:
+            duplicates_dropped.inc()
+            return
+        if status == LATE and jitter_buffer is None and DROP_LATE_FRAMES:
+            late_dropped.inc()
+            return
+
+    if jitter_buffer is not None and frame.timestamp is not None:
+        frame = jitter_buffer.push(frame, time.time() * 1000.0)
+        if frame is None:
+            return
+    send_frame(frame)
+
+async def jitter_pump():
+    """Relâche les trames du tampon de gigue à leur instant de sortie."""
+    tick = JITTER_TICK_MS / 1000.0
+    while True:
+        next_due = jitter_buffer.next_due()
+        wait = tick if next_due is None else min(tick, max(0.0, next_due / 1000.0 - time.time()))
+        await asyncio.sleep(wait)
+        for frame in jitter_buffer.pop_due(time.time() * 1000.0):
+            send_frame(frame)
+
+async def report_metrics(interval: float = METRICS_INTERVAL_S):
+    """Affiche périodiquement un résumé des métriques du pont."""
+    last = frames_sent.value
+    while True:
+        await asyncio.sleep(interval)
+        decode, send = decode_time.summary(), osc_send_time.summary()
+        rate = (frames_sent.value - last) / interval
+        last = frames_sent.value
+        print(f"[METRICS] {rate:.0f} trames/s | messages WS {ws_messages.value}, invalides {invalid_messages.value}, "
+              f"erreurs OSC {osc_errors.value} | décodage p50 {decode['p50_ms']:.3f} ms p99 {decode['p99_ms']:.3f} ms "
+              f"| envoi OSC p50 {send['p50_ms']:.3f} ms p99 {send['p99_ms']:.3f} ms")
+        seq = seq_tracker.totals()
+        line = (f"[METRICS] {seq['devices']} devices | trous {seq['gaps']} ({seq['missing']} trames manquantes), "
+                f"doublons {seq['duplicates']}, en retard {seq['late']}, redémarrages {seq['resets']}")
+        if jitter_buffer is not None:
+            jb = jitter_buffer.stats()
+            delays = list(jb["delay_ms"].values())
+            line += (f" | gigue : profondeur {jb['depth']}, délai max {max(delays, default=0.0):.1f} ms, "
+                     f"sorties en retard {jb['late']}, jetées {jb['dropped']}")
+        print(line)
 
 # -------------------------------------------------------------------
 # 3. INITIALISATION CLIENT OSC
 # -------------------------------------------------------------------
+def set_osc_target(ip: str, port: int):
+    """(Re)crée la socket UDP vers la destination OSC."""
+    global osc_socket, osc_address
+    family, _, _, _, osc_address = socket.getaddrinfo(ip, port, type=socket.SOCK_DGRAM)[0]
+    osc_socket = socket.socket(family, socket.SOCK_DGRAM)
+    print(f"✅ Client OSC prêt → udp://{ip}:{port} (base: {OSC_BASE}, bundles: {OSC_USE_BUNDLES})")
+
 try:
-    osc_client = SimpleUDPClient(OSC_IP, OSC_PORT)
-    print(f"✅ Client OSC prêt → udp://{OSC_IP}:{OSC_PORT} (base: {OSC_BASE})")
+    set_osc_target(OSC_IP, OSC_PORT)
+    osc_encoder = OscFrameEncoder(OSC_BASE)
 except Exception as e:
     print(f"❌ Erreur lors de la création du client OSC : {e}")
     raise
@@ -57,86 +163,46 @@ except Exception as e:
 # -------------------------------------------------------------------
 # 4. PONT WS → OSC
 # -------------------------------------------------------------------
-async def ws_bridge():
+async def ws_bridge(uri: str = WS_SERVER_URI):
     """
-    Se connecte au serveur WebSocket et traduit les messages JSON reçus en messages OSC.
+    Se connecte au serveur WebSocket et traduit les messages reçus (trames
+    binaires ou JSON) en messages OSC.
     Garde la connexion ouverte indéfiniment (reconnexion automatique en cas d’échec).
     """
     while True:
         try:
             async with websockets.connect(
-                WS_SERVER_URI,
+                uri,
                 ping_interval=20,
                 ping_timeout=20,
                 max_queue=32,
                 close_timeout=5
             ) as websocket:
-                print(f"🔌 Connecté au serveur WebSocket : {WS_SERVER_URI}")
+                print(f"🔌 Connecté au serveur WebSocket : {uri}")
                 
                 async for message in websocket:
-                    print("[INFO] Message WS reçu — décodage...")
+                    ws_messages.inc()
+                    if metrics.DEBUG and metrics.sampled("ws_message"):
+                        print(f"[DEBUG] Message WS reçu ({len(message)} {'octets' if isinstance(message, bytes) else 'caractères'})")
 
-                    # --- Décodage JSON ---
+                    # --- Décodage : trame binaire, lot de trames ou JSON (anciens serveurs) ---
+                    start = time.perf_counter()
+                    # Les trames illisibles d'un lot sont écartées une à une
+                    errors = []
                     try:
-                        data = json.loads(message)
-                    except json.JSONDecodeError:
-                        print("[ERROR] Message WS non valide (pas JSON). Ignoré.")
-                        continue
-
-                    device_id = data.get("deviceId", "unknown")
-                    seq = data.get("seq")
-                    timestamp = data.get("timestamp")
-                    sensors = data.get("sensors", {}) or {}
+                        frames = decode_message(message, errors)
+                    except (ValueError, AttributeError, struct.error) as e:
+                        frames, errors = [], [e]
+                    if errors:
+                        invalid_messages.inc(len(errors))
+                        if invalid_messages.value == len(errors) or metrics.sampled("invalid"):
+                            print(f"[ERROR] Trame WS non valide ({errors[0]}). Ignorée ({invalid_messages.value} au total).")
+                        if not frames:
+                            continue
+                    decode_time.record(time.perf_counter() - start)
 
-                    sid = sanitize_id(device_id)
-                    common_args = []
-
-                    # Ajoute seq et timestamp si dispo
-                    try:
-                        common_args.append(int(seq))
-                    except Exception:
-                        common_args.append(None)
-                    try:
-                        common_args.append(int(timestamp))
-                    except Exception:
-                        common_args.append(None)
-
-                    # === 1) ACCELEROMÈTRE ===
-                    accel = sensors.get("accelerometer") or sensors.get("acceleration")
-                    if accel:
-                        ax, ay, az = (
-                            safe_float(accel.get("x")),
-                            safe_float(accel.get("y")),
-                            safe_float(accel.get("z")),
-                        )
-                        addr = f"{OSC_BASE}/{sid}/accelerometer"
-                        osc_send(addr, common_args, [ax, ay, az])
-
-                    # === 2) GYROSCOPE ===
-                    gyro = sensors.get("gyroscope")
-                    if gyro:
-                        if all(k in gyro for k in ("x", "y", "z")):
-                            ga, gb, gc = map(safe_float, (gyro["x"], gyro["y"], gyro["z"]))
-                        elif all(k in gyro for k in ("alpha", "beta", "gamma")):
-                            ga, gb, gc = map(
-                                safe_float, (gyro["alpha"], gyro["beta"], gyro["gamma"])
-                            )
-                        else:
-                            print("[WARN] Gyro sans composantes reconnues :", gyro)
-                            ga = gb = gc = 0.0
-                        addr = f"{OSC_BASE}/{sid}/gyroscope"
-                        osc_send(addr, common_args, [ga, gb, gc])
-
-                    # === 3) ORIENTATION ===
-                    orient = sensors.get("orientation")
-                    if orient:
-                        oa, ob, oc = (
-                            safe_float(orient.get("alpha")),
-                            safe_float(orient.get("beta")),
-                            safe_float(orient.get("gamma")),
-                        )
-                        addr = f"{OSC_BASE}/{sid}/orientation"
-                        osc_send(addr, common_args, [oa, ob, oc])
+                    for frame in frames:
+                        handle_frame(frame)
 
         except websockets.exceptions.ConnectionClosed as e:
             print(f"[WARN] Connexion WS fermée : {e}. Tentative de reconnexion dans 5s...")
@@ -152,11 +218,97 @@ async def ws_bridge():
             await asyncio.sleep(5)
 
 # -------------------------------------------------------------------
-# 5. MAIN
+# 5. PONT MÉMOIRE PARTAGÉE → OSC
+# -------------------------------------------------------------------
+async def shm_bridge(name: str = SHM_RING_NAME):
+    """
+    Variante locale du pont : lit les trames directement dans l'anneau en
+    mémoire partagée du serveur (lancé avec --shm), sans WebSocket ni décodage.
+    """
+    reader = None
+    while reader is None:
+        try:
+            reader = ShmRingReader(name)
+        except FileNotFoundError:
+            print(f"[WARN] Mémoire partagée '{name}' absente (serveur lancé avec --shm ?). Nouvelle tentative dans 5s...")
+            await asyncio.sleep(5)
+    print(f"🔌 Attaché à la mémoire partagée : {name}")
+
+    # On ne rejoue pas l'historique des devices déjà présents ; ceux qui
+    # apparaissent ensuite sont lus depuis leur premier enregistrement
+    devices = reader.devices()
+    cursors = {slot: reader.cursor(slot) for slot in devices}
+    try:
+        while True:
+            if len(devices) != int(reader.header[5]):
+                for slot, device_id in reader.devices().items():
+                    if slot not in devices:
+                        devices[slot] = device_id
+                        cursors[slot] = 0
+            for slot, device_id in devices.items():
+                values, meta, cursors[slot] = reader.read(slot, cursors[slot])
+                for frame in reader.frames(device_id, values, meta):
+                    handle_frame(frame)
+            await asyncio.sleep(SHM_POLL_MS / 1000.0)
+    finally:
+        reader.close()
+
+# -------------------------------------------------------------------
+# 6. MAIN
 # -------------------------------------------------------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pont WebSocket → OSC")
+    parser.add_argument("--shm", nargs="?", const=SHM_RING_NAME, default=None, metavar="NAME",
+                        help="lire les trames dans la mémoire partagée du serveur au lieu du WebSocket")
+    parser.add_argument("--uri", default=WS_SERVER_URI, help="URI /ws du serveur (receiver)")
+    parser.add_argument("--osc-host", default=OSC_IP)
+    parser.add_argument("--osc-port", type=int, default=OSC_PORT)
+    parser.add_argument("--log-level", choices=metrics.LOG_LEVELS, default=metrics.LOG_LEVEL,
+                        help="debug : journal échantillonné des messages reçus")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL_S,
+                        help="période du résumé des métriques en secondes (0 = désactivé)")
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_TARGET_MS,
+                        help="délai cible du tampon de gigue en ms (0 = désactivé)")
+    parser.add_argument("--jitter-fixed", action="store_true",
+                        help="délai de gigue fixe (pas d'adaptation à la gigue mesurée)")
+    parser.add_argument("--devices", help="abonnement : devices voulus ('a,b', défaut : tous)")
+    parser.add_argument("--sensors", help="abonnement : capteurs voulus ('orientation,gyroscope', défaut : tous)")
+    parser.add_argument("--max-hz", type=float, help="abonnement : cadence maximale par device")
+    parser.add_argument("--deadband", type=float, help="abonnement : variation minimale pour recevoir une trame")
+    args = parser.parse_args()
+
+    subscription = {name: value for name, value in (
+        ("devices", args.devices), ("sensors", args.sensors),
+        ("max_hz", args.max_hz), ("deadband", args.deadband),
+    ) if value is not None}
+    if subscription:
+        args.uri += ("&" if "?" in args.uri else "?") + urlencode(subscription)
+
+    metrics.set_log_level(args.log_level)
+    metrics.bind_models()
+    if (args.osc_host, args.osc_port) != (OSC_IP, OSC_PORT):
+        set_osc_target(args.osc_host, args.osc_port)
+
+    if args.jitter_ms > 0:
+        jitter_buffer = JitterBuffer(args.jitter_ms, adaptive=JITTER_ADAPTIVE and not args.jitter_fixed,
+                                     max_delay_ms=JITTER_MAX_MS)
+        print(f"⏱️  Tampon de gigue : {args.jitter_ms:g} ms ({'adaptatif' if jitter_buffer.adaptive else 'fixe'})")
+
+    async def main():
+        bridge = shm_bridge(args.shm) if args.shm else ws_bridge(args.uri)
+        tasks = []
+        if args.metrics_interval > 0:
+            tasks.append(asyncio.create_task(report_metrics(args.metrics_interval)))
+        if jitter_buffer is not None:
+            tasks.append(asyncio.create_task(jitter_pump()))
+        try:
+            await bridge
+        finally:
+            for task in tasks:
+                task.cancel()
+
     print("🚀 Démarrage du pont WebSocket → OSC (Ctrl+C pour quitter)")
     try:
-        asyncio.run(ws_bridge())
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("🛑 Arrêt demandé par l’utilisateur.")
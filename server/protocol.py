@@ -0,0 +1,328 @@
+"""
+Format binaire compact des trames capteurs échangées sur /ws.
+
+Une trame binaire = un en-tête fixe suivi de l'identifiant du device et des
+valeurs float32 des capteurs présents :
+
+    magic    2s   b"MC"
+    version  B    PROTOCOL_VERSION
+    flags    B    bits 0-4 : capteurs présents (ordre de SENSORS)
+                  bit 6    : seq présent
+                  bit 7    : timestamp présent
+    seq      I    numéro de séquence (uint32)
+    ts       d    timestamp en ms (float64, Date.now() côté téléphone)
+    id_len   B    longueur de l'identifiant (octets UTF-8)
+    id       ...  identifiant du device
+    values   ...  3 x float32 par capteur présent, dans l'ordre de SENSORS
+
+Tout est en little-endian. Le format JSON historique reste supporté : les
+fonctions ci-dessous convertissent dans les deux sens.
+"""
+
+import json
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+PROTOCOL_VERSION = 1
+MAGIC = b"MC"
+
+# Ordre des capteurs dans la trame binaire (et des lignes de Frame.values)
+SENSORS = ("accelerometer", "gyroscope", "orientation", "magnetometer", "gravity")
+SENSOR_AXES = {
+    "accelerometer": ("x", "y", "z"),
+    "gyroscope": ("x", "y", "z"),
+    "orientation": ("alpha", "beta", "gamma"),
+    "magnetometer": ("x", "y", "z"),
+    "gravity": ("x", "y", "z"),
+}
+# Noms alternatifs acceptés dans le JSON des anciens clients
+SENSOR_ALIASES = {
+    "accelerometer": ("accelerometer", "acceleration"),
+    "gyroscope": ("gyroscope",),
+    "orientation": ("orientation",),
+    "magnetometer": ("magnetometer", "mag"),
+    "gravity": ("gravity",),
+}
+NUM_SENSORS = len(SENSORS)
+NUM_VALUES = NUM_SENSORS * 3
+
+SENSOR_MASK = (1 << NUM_SENSORS) - 1
+FLAG_SEQ = 1 << 6
+FLAG_TIMESTAMP = 1 << 7
+
+HEADER = struct.Struct("<2sBBIdB")
+MAX_ID_LEN = 255
+
+# Trame décodée. values est un tableau float32 (NUM_SENSORS, 3) ; les lignes
+# des capteurs absents (bit non positionné dans mask) valent 0.
+Frame = namedtuple("Frame", ["device_id", "seq", "timestamp", "mask", "values"])
+
+
+def sensor_bit(name: str) -> int:
+    """Bit du capteur `name` dans le champ flags."""
+    return 1 << SENSORS.index(name)
+
+
+def _to_float(v) -> float:
+    try:
+        return float(v)
+    except Exception:
+        return 0.0
+
+
+def encode_frame(device_id, seq, timestamp, values, mask: int) -> bytes:
+    """
+    Encode une trame binaire.
+    `values` : tableau (NUM_SENSORS, 3) ; seules les lignes présentes dans
+    `mask` sont écrites.
+    """
+    dev = str(device_id).encode("utf-8")[:MAX_ID_LEN]
+    flags = mask & SENSOR_MASK
+    if seq is not None:
+        flags |= FLAG_SEQ
+    if timestamp is not None:
+        flags |= FLAG_TIMESTAMP
+    header = HEADER.pack(
+        MAGIC,
+        PROTOCOL_VERSION,
+        flags,
+        int(seq or 0) & 0xFFFFFFFF,
+        float(timestamp or 0.0),
+        len(dev),
+    )
+    rows = [i for i in range(NUM_SENSORS) if mask & (1 << i)]
+    payload = np.asarray(values, dtype="<f4").reshape(NUM_SENSORS, 3)[rows].tobytes()
+    return header + dev + payload
+
+
+def is_binary_frame(buf) -> bool:
+    return len(buf) >= HEADER.size and bytes(buf[:2]) == MAGIC
+
+
+def _check_frame(buf):
+    """Vérifie en-tête et taille d'une trame binaire ; retourne (en-tête, rows). Lève ValueError."""
+    if len(buf) < HEADER.size:
+        raise ValueError("Trame binaire trop courte")
+    header = HEADER.unpack_from(buf, 0)
+    magic, version, flags, _, _, id_len = header
+    if magic != MAGIC:
+        raise ValueError("Magic de trame invalide")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Version de protocole non supportée: {version}")
+    mask = flags & SENSOR_MASK
+    rows = [i for i in range(NUM_SENSORS) if mask & (1 << i)]
+    if len(buf) - HEADER.size - id_len != len(rows) * 12:
+        raise ValueError("Taille de trame incohérente avec les capteurs annoncés")
+    return header, rows
+
+
+def check_frame(buf):
+    """
+    Valide une trame binaire sans la décoder (ni allocation NumPy, ni UTF-8).
+    Lève ValueError si elle est invalide.
+    """
+    _check_frame(buf)
+
+
+def decode_frame(buf) -> Frame:
+    """Décode une trame binaire. Lève ValueError si la trame est invalide."""
+    (_, _, flags, seq, timestamp, id_len), rows = _check_frame(buf)
+    offset = HEADER.size
+    device_id = bytes(buf[offset:offset + id_len]).decode("utf-8", errors="replace")
+    offset += id_len
+    mask = flags & SENSOR_MASK
+
+    values = np.zeros((NUM_SENSORS, 3), dtype=np.float32)
+    if rows:
+        values[rows] = np.frombuffer(buf, dtype="<f4", count=len(rows) * 3, offset=offset).reshape(-1, 3)
+
+    return Frame(
+        device_id,
+        seq if flags & FLAG_SEQ else None,
+        timestamp if flags & FLAG_TIMESTAMP else None,
+        mask,
+        values,
+    )
+
+
+def frame_from_json(data: dict) -> Frame:
+    """Convertit un message JSON (ancien format) en Frame."""
+    sensors = data.get("sensors") or {}
+    values = np.zeros((NUM_SENSORS, 3), dtype=np.float32)
+    mask = 0
+    for i, name in enumerate(SENSORS):
+        reading = None
+        for alias in SENSOR_ALIASES[name]:
+            reading = sensors.get(alias)
+            if reading:
+                break
+        if not reading:
+            continue
+        axes = SENSOR_AXES[name]
+        # Le gyroscope peut arriver en x/y/z ou en alpha/beta/gamma
+        if not any(k in reading for k in axes):
+            axes = ("alpha", "beta", "gamma") if axes[0] == "x" else ("x", "y", "z")
+        values[i] = [_to_float(reading.get(k)) for k in axes]
+        mask |= 1 << i
+
+    seq = data.get("seq")
+    timestamp = data.get("timestamp")
+    try:
+        seq = int(seq)
+    except Exception:
+        seq = None
+    try:
+        timestamp = float(timestamp)
+    except Exception:
+        timestamp = None
+
+    return Frame(str(data.get("deviceId", "unknown")), seq, timestamp, mask, values)
+
+
+def frame_to_json_dict(frame: Frame) -> dict:
+    """Convertit une Frame en dictionnaire au format JSON historique."""
+    sensors = {}
+    for i, name in enumerate(SENSORS):
+        if frame.mask & (1 << i):
+            sensors[name] = dict(zip(SENSOR_AXES[name], frame.values[i].tolist()))
+    return {
+        "deviceId": frame.device_id,
+        "seq": frame.seq,
+        "timestamp": frame.timestamp,
+        "sensors": sensors,
+    }
+
+
+class SourcePacket:
+    """
+    Message reçu d'une source, dans son encodage d'origine (texte JSON ou
+    trame binaire). Les conversions et le décodage sont faits à la demande
+    et mis en cache : un message n'est ré-encodé qu'une seule fois, quel que
+    soit le nombre de receivers qui le demandent dans l'autre format.
+    Il en va de même des versions réduites à un sous-ensemble de capteurs
+    (subset) : une par masque, chacune sérialisée au plus une fois par format.
+    """
+    __slots__ = ("text", "data", "_frame", "_subsets")
+
+    def __init__(self, text: str = None, data: bytes = None):
+        self.text = text
+        self.data = data
+        self._frame = None
+        self._subsets = None
+
+    @property
+    def frame(self) -> Frame:
+        if self._frame is None:
+            if self.data is not None:
+                self._frame = decode_frame(self.data)
+            else:
+                self._frame = frame_from_json(json.loads(self.text))
+        return self._frame
+
+    def as_text(self) -> str:
+        if self.text is None:
+            self.text = json.dumps(frame_to_json_dict(self.frame))
+        return self.text
+
+    def as_bytes(self) -> bytes:
+        if self.data is None:
+            f = self.frame
+            self.data = encode_frame(f.device_id, f.seq, f.timestamp, f.values, f.mask)
+        return self.data
+
+    def subset(self, mask: int) -> "SourcePacket":
+        """Message réduit aux capteurs de `mask` (mis en cache par masque)."""
+        if self._subsets is None:
+            self._subsets = {}
+        packet = self._subsets.get(mask)
+        if packet is None:
+            f = self.frame
+            packet = SourcePacket()
+            packet._frame = f._replace(mask=f.mask & mask)
+            self._subsets[mask] = packet
+        return packet
+
+
+# -------------------------------------------------------------------
+# Lots de trames (receivers en mode agrégation)
+# -------------------------------------------------------------------
+# Binaire : en-tête "MB" | version u8 | nombre u16, puis pour chaque trame
+# sa longueur (u16) suivie de la trame binaire elle-même.
+# JSON    : {"type": "batch", "frames": [<message>, <message>, ...]}
+BATCH_MAGIC = b"MB"
+BATCH_HEADER = struct.Struct("<2sBH")
+BATCH_ITEM = struct.Struct("<H")
+MAX_BATCH = 0xFFFF
+
+
+def encode_batch(frames) -> bytes:
+    """Regroupe des trames binaires déjà encodées en un seul message."""
+    parts = [BATCH_HEADER.pack(BATCH_MAGIC, PROTOCOL_VERSION, len(frames))]
+    for f in frames:
+        parts.append(BATCH_ITEM.pack(len(f)))
+        parts.append(f)
+    return b"".join(parts)
+
+
+def iter_batch(buf):
+    """Itère sur les trames binaires (memoryview) contenues dans un lot."""
+    magic, version, count = BATCH_HEADER.unpack_from(buf, 0)
+    if magic != BATCH_MAGIC:
+        raise ValueError("Magic de lot invalide")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Version de protocole non supportée: {version}")
+    view = memoryview(buf)
+    offset = BATCH_HEADER.size
+    for _ in range(count):
+        (size,) = BATCH_ITEM.unpack_from(buf, offset)
+        offset += BATCH_ITEM.size
+        if offset + size > len(buf):
+            raise ValueError("Lot tronqué")
+        yield view[offset:offset + size]
+        offset += size
+
+
+def encode_batch_text(messages) -> str:
+    """Regroupe des messages JSON déjà sérialisés, sans les re-parser."""
+    return '{"type": "batch", "frames": [' + ",".join(messages) + "]}"
+
+
+def decode_message(message, errors: list = None) -> list:
+    """
+    Décode un message WebSocket reçu par un receiver (trame binaire, lot
+    binaire, JSON ou lot JSON) en liste de Frame.
+    Avec `errors` (liste), les trames illisibles d'un lot sont ignorées une à
+    une (leur exception est ajoutée à `errors`) au lieu de faire rejeter tout
+    le lot. Un message illisible dans son ensemble lève toujours l'exception.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        if bytes(message[:2]) == BATCH_MAGIC:
+            return _decode_items(iter_batch(message), decode_frame, errors)
+        return [decode_frame(message)]
+
+    data = json.loads(message)
+    if isinstance(data, dict) and data.get("type") == "batch":
+        return _decode_items(iter(data.get("frames") or []), frame_from_json, errors)
+    return [frame_from_json(data)]
+
+
+def _decode_items(items, decode, errors):
+    if errors is None:
+        return [decode(item) for item in items]
+    frames = []
+    while True:
+        try:
+            item = next(items)
+        except StopIteration:
+            break
+        except (ValueError, struct.error) as e:
+            # Lot tronqué : les trames suivantes sont illisibles
+            errors.append(e)
+            break
+        try:
+            frames.append(decode(item))
+        except (ValueError, AttributeError, TypeError, struct.error) as e:
+            errors.append(e)
+    return frames
@@ -0,0 +1,219 @@
+"""
+Enregistrement des sessions côté serveur.
+
+Avec `python main.py --record [DIR]` (ou POST /record/start), chaque trame
+reçue d'une source est ajoutée au journal binaire de son device, sans passer
+par le CSV construit dans le navigateur :
+
+    DIR/<deviceId>/<AAAAMMJJ_HHMMSS>_<n>.mcrec
+
+Un journal commence par RECORD_MAGIC, puis une suite d'enregistrements :
+
+    length    u32   taille de la trame
+    recv_time f64   heure de réception (secondes epoch, horloge du serveur)
+    frame     ...   trame binaire (voir protocol.py)
+
+Le fichier est en ajout seul : une session interrompue reste lisible jusqu'au
+dernier enregistrement complet (iter_records() s'arrête proprement sur un
+enregistrement tronqué).
+
+Sur la boucle asyncio, record() ne fait que déposer la trame dans une file
+bornée (jamais d'attente ; si le disque ne suit pas, les trames en trop sont
+comptées dans `dropped`). Un thread écrivain vide la file par lots dans des
+fichiers à gros tampon, les vide sur disque toutes les `flush_s` secondes et
+passe à un nouveau fichier au-delà de `rotate_bytes` ou `rotate_s`.
+"""
+
+import os
+import queue
+import re
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from protocol import HEADER, is_binary_frame
+
+DEFAULT_RECORD_DIR = "recordings"
+RECORD_MAGIC = b"MCREC1\n\x00"
+RECORD_HEADER = struct.Struct("<Id")
+RECORD_SUFFIX = ".mcrec"
+
+_STOP = object()
+
+
+def frame_device_id(frame: bytes) -> str:
+    """deviceId d'une trame binaire, lu dans l'en-tête sans décoder les valeurs."""
+    id_len = frame[HEADER.size - 1]
+    return bytes(frame[HEADER.size:HEADER.size + id_len]).decode("utf-8", errors="replace")
+
+
+def safe_dirname(device_id: str) -> str:
+    """Nom de dossier sûr pour un deviceId quelconque."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", device_id).strip(".") or "unknown"
+
+
+def iter_records(path):
+    """Lit un journal : génère (recv_time, trame binaire) pour chaque enregistrement complet."""
+    with open(path, "rb") as f:
+        if f.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError(f"{path} : ce n'est pas un journal d'enregistrement mocap")
+        while True:
+            head = f.read(RECORD_HEADER.size)
+            if len(head) < RECORD_HEADER.size:
+                return
+            length, recv_time = RECORD_HEADER.unpack(head)
+            frame = f.read(length)
+            if len(frame) < length:
+                return
+            yield recv_time, frame
+
+
+class _LogFile:
+    """Journal courant d'un device."""
+
+    def __init__(self, directory: Path, buffer_bytes: int):
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        n = 0
+        while (directory / f"{stamp}_{n}{RECORD_SUFFIX}").exists():
+            n += 1
+        self.path = directory / f"{stamp}_{n}{RECORD_SUFFIX}"
+        self.file = open(self.path, "xb", buffering=buffer_bytes)
+        self.file.write(RECORD_MAGIC)
+        self.size = len(RECORD_MAGIC)
+        self.opened = time.monotonic()
+
+    def write(self, recv_time: float, frame: bytes):
+        self.file.write(RECORD_HEADER.pack(len(frame), recv_time))
+        self.file.write(frame)
+        self.size += RECORD_HEADER.size + len(frame)
+
+    def close(self):
+        self.file.close()
+
+
+class SessionRecorder:
+    """Enregistreur en flux : une file bornée et un thread écrivain."""
+
+    def __init__(self, directory=DEFAULT_RECORD_DIR, buffer_bytes: int = 1 << 20,
+                 rotate_bytes: int = 64 << 20, rotate_s: float = 600.0,
+                 flush_s: float = 1.0, max_queue: int = 100_000):
+        self.directory = Path(directory)
+        self.buffer_bytes = buffer_bytes
+        self.rotate_bytes = rotate_bytes
+        self.rotate_s = rotate_s
+        self.flush_s = flush_s
+        self._queue = queue.Queue(max_queue)
+        self._files = {}
+        self._thread = None
+
+        # Statistiques
+        self.recorded = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.bytes = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="mocap-recorder", daemon=True)
+        self._thread.start()
+        print(f"[RECORD] Enregistrement des sessions dans {self.directory.resolve()}")
+
+    def record(self, packet):
+        """Tap du ConnectionManager : dépose la trame sans jamais attendre."""
+        try:
+            frame = packet.as_bytes()
+        except Exception:
+            frame = None
+        if frame is None or not is_binary_frame(frame):
+            self.invalid += 1
+            return
+        try:
+            self._queue.put_nowait((time.time(), frame))
+        except queue.Full:
+            self.dropped += 1
+
+    def _log(self, device_id: str) -> _LogFile:
+        log = self._files.get(device_id)
+        if log is not None and (log.size >= self.rotate_bytes
+                                or time.monotonic() - log.opened >= self.rotate_s):
+            log.close()
+            log = None
+            self.rotations += 1
+        if log is None:
+            log = self._files[device_id] = _LogFile(self.directory / safe_dirname(device_id), self.buffer_bytes)
+        return log
+
+    def _write(self, item):
+        recv_time, frame = item
+        try:
+            log = self._log(frame_device_id(frame))
+            log.write(recv_time, frame)
+            self.recorded += 1
+            self.bytes += RECORD_HEADER.size + len(frame)
+        except OSError as e:
+            self.errors += 1
+            if self.errors == 1 or self.errors % 1000 == 0:
+                print(f"[RECORD] Erreur d'écriture ({self.errors}) : {e}")
+
+    def _flush_all(self):
+        for log in self._files.values():
+            try:
+                log.file.flush()
+            except OSError:
+                self.errors += 1
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_s
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=self.flush_s)
+            except queue.Empty:
+                item = None
+
+            # Vide tout ce qui est déjà en file avant de rendre la main
+            while item is not None:
+                if item is _STOP:
+                    running = False
+                    break
+                self._write(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            if time.monotonic() >= next_flush:
+                self._flush_all()
+                next_flush = time.monotonic() + self.flush_s
+
+        for log in self._files.values():
+            log.close()
+        self._files.clear()
+
+    def stop(self):
+        """Écrit les trames en attente et ferme les journaux (bloquant : appeler hors de la boucle)."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        print(f"[RECORD] Enregistrement arrêté ({self.recorded} trames, {self.bytes / 1e6:.1f} Mo)")
+
+    def stats(self) -> dict:
+        return {
+            "directory": str(self.directory.resolve()),
+            "recording": self._thread is not None,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "invalid": self.invalid,
+            "queued": self._queue.qsize(),
+            "bytes": self.bytes,
+            "files": {device_id: os.fspath(log.path) for device_id, log in dict(self._files).items()},
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
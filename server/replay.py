@@ -0,0 +1,273 @@
+"""
+Rejoue des sessions enregistrées comme si des téléphones étaient connectés.
+
+Entrées (fichiers, dossiers ou motifs glob) :
+- CSV brut du client (format de data/dataset1_3x40.csv) : les échantillons
+  de chaque capteur sont regroupés par instant `t` en trames, à partir de
+  start_time_iso + t ;
+- journaux du serveur (*.mcrec, voir recorder.py), rythmés par l'heure de
+  réception de chaque trame.
+Chaque fichier est rejoué depuis son début : plusieurs fichiers passent en
+parallèle.
+
+Cibles :
+- ws  : chaque device est une connexion 'source' sur /ws (JSON ou binaire),
+        exactement comme un téléphone ;
+- osc : les trames passent directement par send_frame() de osc_sender.py
+        (destination OSC_IP:OSC_PORT configurée dans osc_sender.py).
+
+Rythme : temps réel (--speed 1, défaut), accéléré (--speed 10) ou aussi vite
+que possible (--speed 0). --devices N rejoue N copies de chaque device
+(deviceId suffixé -1..-N), décalées dans le temps avec --stagger-ms.
+
+    python replay.py ../data/dataset1_3x40.csv --devices 50 --speed 4
+    python replay.py recordings/ --target osc --speed 0 --loops 3
+
+seq est renuméroté par device virtuel et timestamp vaut l'heure d'envoi,
+comme pour une vraie source.
+"""
+
+import argparse
+import asyncio
+import csv
+import glob
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import websockets
+
+from protocol import NUM_SENSORS, SENSORS, Frame, decode_frame, encode_frame, frame_to_json_dict
+from recorder import RECORD_SUFFIX, iter_records
+
+WS_SOURCE_URI = "ws://127.0.0.1:8000/ws?client_type=source"
+
+# (colonne du CSV, capteur, clés de chaque échantillon)
+CSV_SENSORS = (
+    ("accel", "accelerometer", ("ax", "ay", "az")),
+    ("gyro", "gyroscope", ("gx", "gy", "gz")),
+    ("orientation", "orientation", ("alpha", "beta", "gamma")),
+    ("mag", "magnetometer", ("mx", "my", "mz")),
+    ("gravity", "gravity", ("gx", "gy", "gz")),
+)
+
+
+class Track:
+    """Trames d'un device : instants relatifs (ms), masques et valeurs (n, NUM_SENSORS, 3)."""
+
+    def __init__(self, device_id, times, masks, values):
+        self.device_id = device_id
+        self.times = times
+        self.masks = masks
+        self.values = values
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration_ms(self):
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+
+def _build_tracks(samples):
+    """{deviceId: {instant_ms: (mask, values)}} -> {deviceId: Track}, instants relatifs au début du fichier."""
+    if not samples:
+        return {}
+    t0 = min(min(frames) for frames in samples.values() if frames)
+    tracks = {}
+    for device_id, frames in samples.items():
+        times = sorted(frames)
+        tracks[device_id] = Track(
+            device_id,
+            np.array(times, dtype=np.float64) - t0,
+            np.array([frames[t][0] for t in times], dtype=np.int64),
+            np.stack([frames[t][1] for t in times]) if times else np.zeros((0, NUM_SENSORS, 3), np.float32),
+        )
+    return tracks
+
+
+def is_raw_csv(path):
+    """Vrai si le CSV a les colonnes du client (pas un CSV déjà prétraité)."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), [])
+    return "start_time_iso" in header and any(column in header for column, _, _ in CSV_SENSORS)
+
+
+def load_csv(path):
+    """Tracks d'un CSV brut : une trame par instant, avec les capteurs échantillonnés à cet instant."""
+    samples = {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            device_id = row.get("device_id") or "replay"
+            start = datetime.fromisoformat(row["start_time_iso"]).timestamp() * 1000.0
+            frames = samples.setdefault(device_id, {})
+            for column, sensor, keys in CSV_SENSORS:
+                if not row.get(column):
+                    continue
+                i = SENSORS.index(sensor)
+                for s in json.loads(row[column]):
+                    v = [s.get(k) for k in keys]
+                    if s.get("t") is None or None in v:
+                        continue
+                    t = start + float(s["t"])
+                    mask, values = frames.get(t) or (0, np.zeros((NUM_SENSORS, 3), dtype=np.float32))
+                    values[i] = v
+                    frames[t] = (mask | (1 << i), values)
+    return _build_tracks(samples)
+
+
+def load_log(path):
+    """Tracks d'un journal du serveur, rythmées par l'heure de réception."""
+    samples = {}
+    for recv_time, data in iter_records(path):
+        try:
+            frame = decode_frame(data)
+        except ValueError:
+            continue
+        samples.setdefault(frame.device_id, {})[recv_time * 1000.0] = (frame.mask, frame.values)
+    return _build_tracks(samples)
+
+
+def load_recordings(inputs):
+    """Liste des Track de tous les fichiers (CSV et journaux) désignés par `inputs`."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.csv"), recursive=True)
+            matches += glob.glob(os.path.join(item, "**", f"*{RECORD_SUFFIX}"), recursive=True)
+        else:
+            matches = glob.glob(item)
+        files.extend(sorted(matches))
+
+    tracks = []
+    for path in dict.fromkeys(files):
+        if not path.endswith(RECORD_SUFFIX) and not is_raw_csv(path):
+            # CSV prétraité (data_preprocessing.py) ou autre : pas d'horodatage à rejouer
+            print(f"[REPLAY] {path} : pas un CSV brut du client, ignoré")
+            continue
+        loaded = load_log(path) if path.endswith(RECORD_SUFFIX) else load_csv(path)
+        tracks.extend(t for t in loaded.values() if len(t))
+        print(f"[REPLAY] {path} : {len(loaded)} device(s), {sum(len(t) for t in loaded.values())} trames")
+    return tracks
+
+
+class ReplayStats:
+    def __init__(self):
+        self.sent = 0
+        self.errors = 0
+        self.max_late_ms = 0.0
+        self.started = time.perf_counter()
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "sent": self.sent,
+            "errors": self.errors,
+            "elapsed_s": elapsed,
+            "rate": self.sent / elapsed if elapsed > 0 else 0.0,
+            "max_late_ms": self.max_late_ms,
+        }
+
+
+async def play(track, device_id, emit, stats, speed=1.0, loops=1, delay_s=0.0):
+    """
+    Rejoue `track` sous l'identifiant `device_id` en appelant `await emit(frame)`.
+    speed=0 : aussi vite que possible ; loops=0 : en boucle sans fin.
+    """
+    loop = asyncio.get_running_loop()
+    if delay_s:
+        await asyncio.sleep(delay_s)
+    seq = 0
+    n = 0
+    while not loops or n < loops:
+        start = loop.time()
+        for i in range(len(track)):
+            if speed:
+                ahead = start + track.times[i] / 1000.0 / speed - loop.time()
+                if ahead > 0.001:
+                    await asyncio.sleep(ahead)
+                elif ahead < 0:
+                    stats.max_late_ms = max(stats.max_late_ms, -ahead * 1000.0)
+            elif i % 256 == 0:
+                # Laisse tourner les autres devices
+                await asyncio.sleep(0)
+
+            frame = Frame(device_id, seq, time.time() * 1000.0, int(track.masks[i]), track.values[i])
+            await emit(frame)
+            stats.sent += 1
+            seq += 1
+        n += 1
+
+
+async def play_ws(track, device_id, stats, url, fmt, **kwargs):
+    """Un device virtuel = une connexion source sur /ws."""
+    if fmt == "binary":
+        encode = lambda f: encode_frame(f.device_id, f.seq, f.timestamp, f.values, f.mask)
+    else:
+        encode = lambda f: json.dumps(frame_to_json_dict(f))
+    try:
+        async with websockets.connect(url, max_queue=None) as ws:
+            await play(track, device_id, lambda f: ws.send(encode(f)), stats, **kwargs)
+    except (OSError, websockets.exceptions.WebSocketException) as e:
+        stats.errors += 1
+        print(f"[REPLAY] {device_id} : connexion interrompue ({e})")
+
+
+async def play_osc(track, device_id, stats, **kwargs):
+    """Envoie directement par le chemin OSC de osc_sender.py."""
+    import osc_sender
+
+    async def emit(frame):
+        osc_sender.send_frame(frame)
+
+    await play(track, device_id, emit, stats, **kwargs)
+
+
+async def replay(tracks, target="ws", url=WS_SOURCE_URI, fmt="json", devices=1,
+                 speed=1.0, loops=1, stagger_ms=0.0):
+    """Rejoue toutes les tracks avec `devices` copies chacune ; retourne les statistiques."""
+    stats = ReplayStats()
+    jobs = []
+    k = 0
+    for copy in range(devices):
+        for track in tracks:
+            device_id = track.device_id if devices == 1 else f"{track.device_id}-{copy + 1}"
+            kwargs = dict(speed=speed, loops=loops, delay_s=k * stagger_ms / 1000.0)
+            if target == "osc":
+                jobs.append(play_osc(track, device_id, stats, **kwargs))
+            else:
+                jobs.append(play_ws(track, device_id, stats, url, fmt, **kwargs))
+            k += 1
+
+    print(f"[REPLAY] {len(jobs)} device(s) virtuel(s) → {target}, vitesse {'max' if not speed else f'x{speed:g}'}")
+    await asyncio.gather(*jobs)
+    return stats.summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rejoue des sessions enregistrées vers /ws ou OSC")
+    parser.add_argument("inputs", nargs="+", help="CSV bruts, journaux .mcrec, dossiers ou motifs glob")
+    parser.add_argument("--target", choices=("ws", "osc"), default="ws")
+    parser.add_argument("--url", default=WS_SOURCE_URI, help="URI /ws des sources (cible ws)")
+    parser.add_argument("--format", choices=("json", "binary"), default="json", help="format envoyé sur /ws")
+    parser.add_argument("--devices", type=int, default=1, help="copies virtuelles de chaque device")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = temps réel, 10 = 10x, 0 = aussi vite que possible")
+    parser.add_argument("--loops", type=int, default=1, help="nombre de passes (0 = sans fin)")
+    parser.add_argument("--stagger-ms", type=float, default=0.0, help="décalage de départ entre devices virtuels")
+    args = parser.parse_args()
+
+    tracks = load_recordings(args.inputs)
+    if not tracks:
+        parser.error(f"aucune trame trouvée dans {args.inputs}")
+    try:
+        summary = asyncio.run(replay(
+            tracks, args.target, args.url, args.format, args.devices,
+            args.speed, args.loops, args.stagger_ms,
+        ))
+        print(f"[REPLAY] {summary['sent']} trames en {summary['elapsed_s']:.2f} s "
+              f"({summary['rate']:.0f} trames/s, retard max {summary['max_late_ms']:.1f} ms, "
+              f"erreurs {summary['errors']})")
+    except KeyboardInterrupt:
+        print("🛑 Arrêt demandé par l’utilisateur.")
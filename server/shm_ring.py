@@ -0,0 +1,197 @@
+"""
+Anneau en mémoire partagée entre le serveur et les consommateurs locaux.
+
+Avec `python main.py --shm`, le serveur écrit chaque trame décodée dans un
+segment multiprocessing.shared_memory. Un consommateur sur la même machine
+(pont OSC, modèle ML...) s'y attache et lit les trames directement sous forme
+de vues NumPy : ni TCP, ni WebSocket, ni JSON par échantillon.
+
+Organisation du segment (un anneau par device, enregistrements de taille fixe) :
+
+    header  int64   [8]                        magic, version, max_devices, capacity, n_values, n_devices
+    counts  uint64  [max_devices]              nombre total d'enregistrements écrits par device
+    ids     uint8   [max_devices, ID_BYTES]    deviceId (UTF-8, complété par des zéros)
+    meta    float64 [max_devices, capacity, 3] seq, timestamp (NaN si absent), mask
+    values  float32 [max_devices, capacity, NUM_VALUES]
+
+`values` suit l'ordre de protocol.SENSORS : les 9 premières colonnes sont
+ax, ay, az, gx, gy, gz, alpha, beta, gamma, soit exactement les features
+attendues par SensorBuffer (values[:, :9] est une vue, sans copie).
+
+Un seul écrivain ; l'enregistrement est écrit avant d'incrémenter le
+compteur du device. Un lecteur trop lent (plus de `capacity` enregistrements
+de retard) perd les plus anciens : ils sont comptés dans `lost`.
+"""
+
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+from protocol import NUM_VALUES, Frame
+
+SHM_RING_NAME = "mocap_ring"
+SHM_MAGIC = 0x4D4F434150524E47  # "MOCAPRNG"
+SHM_VERSION = 1
+ID_BYTES = 64
+META_FIELDS = 3
+
+
+def _layout(max_devices: int, capacity: int):
+    """Décalages (octets) de chaque tableau dans le segment, et taille totale."""
+    offsets = {}
+    offset = 0
+    for name, dtype, shape in (
+        ("header", np.int64, (8,)),
+        ("counts", np.uint64, (max_devices,)),
+        ("ids", np.uint8, (max_devices, ID_BYTES)),
+        ("meta", np.float64, (max_devices, capacity, META_FIELDS)),
+        ("values", np.float32, (max_devices, capacity, NUM_VALUES)),
+    ):
+        offsets[name] = (offset, dtype, shape)
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset = (offset + 63) // 64 * 64  # alignement sur une ligne de cache
+    return offsets, offset
+
+
+class _Ring:
+    def _map(self, max_devices: int, capacity: int):
+        offsets, _ = _layout(max_devices, capacity)
+        for name, (offset, dtype, shape) in offsets.items():
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+        self.max_devices = max_devices
+        self.capacity = capacity
+
+    def _release(self):
+        # Les vues NumPy doivent disparaître avant de fermer le segment
+        for name in ("header", "counts", "ids", "meta", "values"):
+            self.__dict__.pop(name, None)
+        self.shm.close()
+
+
+class ShmRingWriter(_Ring):
+    """Côté serveur : publie les trames décodées dans l'anneau."""
+
+    def __init__(self, name: str = SHM_RING_NAME, max_devices: int = 64, capacity: int = 1024):
+        _, size = _layout(max_devices, capacity)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Segment laissé par un serveur précédent : on le recrée
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self._map(max_devices, capacity)
+        self.counts[:] = 0
+        self.ids[:] = 0
+        self.header[:] = (SHM_MAGIC, SHM_VERSION, max_devices, capacity, NUM_VALUES, 0, 0, 0)
+        self._slots = {}
+        self.dropped = 0
+
+    def _slot(self, device_id: str):
+        slot = self._slots.get(device_id)
+        if slot is None:
+            n = len(self._slots)
+            if n >= self.max_devices:
+                return None
+            encoded = device_id.encode("utf-8")[:ID_BYTES]
+            self.ids[n, :len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+            slot = self._slots[device_id] = n
+            self.header[5] = n + 1
+        return slot
+
+    def publish(self, frame: Frame):
+        slot = self._slot(frame.device_id)
+        if slot is None:
+            # Plus de place pour un nouveau device
+            self.dropped += 1
+            return
+        count = int(self.counts[slot])
+        i = count % self.capacity
+        self.values[slot, i] = frame.values.reshape(-1)
+        self.meta[slot, i] = (
+            np.nan if frame.seq is None else frame.seq,
+            np.nan if frame.timestamp is None else frame.timestamp,
+            frame.mask,
+        )
+        self.counts[slot] = count + 1
+
+    def close(self):
+        self._release()
+        self.shm.unlink()
+
+
+class ShmRingReader(_Ring):
+    """Côté consommateur : lit l'anneau publié par le serveur, sans copie."""
+
+    def __init__(self, name: str = SHM_RING_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Le segment appartient au serveur : le resource_tracker de ce
+        # processus ne doit pas le détruire quand le lecteur se termine
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        header = np.ndarray((8,), dtype=np.int64, buffer=self.shm.buf)
+        if header[0] != SHM_MAGIC or header[1] != SHM_VERSION:
+            self.shm.close()
+            raise ValueError(f"Segment '{name}' : ce n'est pas un anneau mocap compatible")
+        if header[4] != NUM_VALUES:
+            self.shm.close()
+            raise ValueError(f"Segment '{name}' : {header[4]} valeurs par enregistrement, {NUM_VALUES} attendues")
+        self._map(int(header[2]), int(header[3]))
+        self.lost = 0
+
+    def devices(self) -> dict:
+        """{slot: deviceId} des devices publiés jusqu'ici."""
+        n = int(self.header[5])
+        return {
+            slot: bytes(self.ids[slot]).rstrip(b"\x00").decode("utf-8", errors="replace")
+            for slot in range(n)
+        }
+
+    def cursor(self, slot: int) -> int:
+        """Position courante de l'écrivain pour ce device (pour ne lire que la suite)."""
+        return int(self.counts[slot])
+
+    def read(self, slot: int, cursor: int):
+        """
+        Enregistrements écrits depuis `cursor`.
+        Retourne (values, meta, nouveau_cursor) ; values est (n, NUM_VALUES)
+        et meta (n, 3). Ce sont des vues sur le segment, sauf quand la
+        plage fait le tour de l'anneau (une copie est alors faite).
+        Les vues restent valides jusqu'à ce que l'écrivain fasse un tour
+        complet : les consommer avant le prochain appel.
+        """
+        end = int(self.counts[slot])
+        start = max(cursor, end - self.capacity)
+        self.lost += start - cursor
+        if start >= end:
+            return self.values[slot, :0], self.meta[slot, :0], end
+
+        i, j = start % self.capacity, end % self.capacity
+        if i < j or j == 0:
+            stop = j or self.capacity
+            values, meta = self.values[slot, i:stop], self.meta[slot, i:stop]
+        else:
+            values = np.concatenate((self.values[slot, i:], self.values[slot, :j]))
+            meta = np.concatenate((self.meta[slot, i:], self.meta[slot, :j]))
+
+        # L'écrivain a pu écraser le début de la plage pendant la lecture
+        overwritten = int(self.counts[slot]) - self.capacity - start
+        if overwritten > 0:
+            self.lost += overwritten
+            values, meta = values[overwritten:], meta[overwritten:]
+        return values, meta, end
+
+    def frames(self, device_id: str, values, meta):
+        """Convertit des enregistrements lus en protocol.Frame."""
+        for row, (seq, timestamp, mask) in zip(values, meta.tolist()):
+            yield Frame(
+                device_id,
+                None if seq != seq else int(seq),
+                None if timestamp != timestamp else timestamp,
+                int(mask),
+                row.reshape(-1, 3),
+            )
+
+    def close(self):
+        self._release()
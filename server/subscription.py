@@ -0,0 +1,162 @@
+"""
+Abonnement d'un receiver : filtrage des trames avant sérialisation.
+
+Par défaut un receiver reçoit tout le flux, à pleine cadence. Un abonnement
+restreint ce qu'il reçoit :
+- devices  : identifiants des devices voulus (défaut : tous)
+- sensors  : capteurs voulus (défaut : tous) ; les autres sont retirés de la
+             trame avant l'envoi
+- max_hz   : cadence maximale par device ; les trames en trop sont jetées
+             (la cadence moyenne reste max_hz même si la source est irrégulière)
+- deadband : une trame n'est envoyée que si au moins une valeur des capteurs
+             voulus a changé de plus de `deadband` depuis la dernière trame
+             envoyée pour ce device
+
+Le filtrage est fait dans ReceiverChannel.offer(), avant la mise en file :
+une trame filtrée ne coûte ni sérialisation, ni place dans la file, ni
+bande passante. La trame réduite aux capteurs voulus est mise en cache sur
+le message source (SourcePacket.subset), donc sérialisée une seule fois par
+(format, capteurs) quel que soit le nombre de receivers abonnés.
+
+Avec max_hz ou deadband, les seq reçus par le receiver ne sont plus
+consécutifs : les trous sont voulus.
+"""
+
+import time
+
+import numpy as np
+
+from protocol import SENSOR_MASK, SENSORS, SourcePacket
+
+
+def _as_list(value):
+    """Liste de noms depuis une liste ou une chaîne 'a,b,c' (None ou vide = tous)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    names = [str(v).strip() for v in value if str(v).strip()]
+    return names or None
+
+
+def sensors_mask(sensors) -> int:
+    """Masque de capteurs (bits de SENSORS) d'une liste de noms ; None = tous."""
+    names = _as_list(sensors)
+    if names is None:
+        return SENSOR_MASK
+    mask = 0
+    for name in names:
+        if name not in SENSORS:
+            raise ValueError(f"Capteur inconnu: {name}")
+        mask |= 1 << SENSORS.index(name)
+    return mask
+
+
+class _DeviceState:
+    __slots__ = ("next_due", "values", "mask")
+
+    def __init__(self):
+        self.next_due = 0.0
+        self.values = None
+        self.mask = 0
+
+
+class Subscription:
+    """Filtre (devices, capteurs, cadence, bande morte) d'un receiver."""
+
+    def __init__(self, devices=None, sensors=None, max_hz: float = None, deadband: float = None):
+        devices = _as_list(devices)
+        self.devices = frozenset(devices) if devices is not None else None
+        self.mask = sensors_mask(sensors)
+        if not self.mask:
+            raise ValueError("Aucun capteur sélectionné")
+        if max_hz is not None and max_hz < 0:
+            raise ValueError("max_hz doit être >= 0")
+        if deadband is not None and deadband < 0:
+            raise ValueError("deadband doit être >= 0")
+        self.max_hz = max_hz or 0.0
+        self.interval = 1.0 / self.max_hz if self.max_hz else 0.0
+        self.deadband = deadband or 0.0
+        self._rows = [i for i in range(len(SENSORS)) if self.mask & (1 << i)]
+        self._state = {}
+
+        # Compteurs des trames écartées, par motif
+        self.filtered_device = 0
+        self.filtered_rate = 0
+        self.filtered_deadband = 0
+
+    @classmethod
+    def from_message(cls, data: dict):
+        """Abonnement décrit par un message {"type": "subscribe", ...} du receiver."""
+        return cls(data.get("devices"), data.get("sensors"), data.get("max_hz"), data.get("deadband"))
+
+    @property
+    def passthrough(self) -> bool:
+        """Vrai si l'abonnement laisse tout passer (aucun décodage nécessaire)."""
+        return (self.devices is None and self.mask == SENSOR_MASK
+                and not self.interval and not self.deadband)
+
+    def filter(self, packet: SourcePacket, now: float = None):
+        """
+        Message à envoyer au receiver pour `packet` (éventuellement réduit aux
+        capteurs voulus), ou None s'il est écarté. Lève une exception si le
+        message source est illisible.
+        """
+        frame = packet.frame
+        if self.devices is not None and frame.device_id not in self.devices:
+            self.filtered_device += 1
+            return None
+
+        mask = frame.mask & self.mask
+        if not mask:
+            self.filtered_device += 1
+            return None
+
+        state = self._state.get(frame.device_id)
+        if state is None:
+            state = self._state[frame.device_id] = _DeviceState()
+
+        if self.interval:
+            if now is None:
+                now = time.monotonic()
+            if now < state.next_due:
+                self.filtered_rate += 1
+                return None
+
+        rows = None
+        if self.deadband and state.values is not None and not (mask & ~state.mask):
+            rows = [i for i in self._rows if mask & (1 << i)]
+            if np.abs(frame.values[rows] - state.values[rows]).max() < self.deadband:
+                self.filtered_deadband += 1
+                return None
+
+        if self.interval:
+            # Au plus une période d'avance : la cadence moyenne reste max_hz
+            state.next_due = max(state.next_due, now - self.interval) + self.interval
+        if self.deadband:
+            if state.values is None:
+                state.values = frame.values.copy()
+            else:
+                if rows is None:
+                    rows = [i for i in self._rows if mask & (1 << i)]
+                state.values[rows] = frame.values[rows]
+            state.mask |= mask
+
+        if mask == frame.mask:
+            return packet
+        return packet.subset(mask)
+
+    @property
+    def filtered(self) -> int:
+        return self.filtered_device + self.filtered_rate + self.filtered_deadband
+
+    def stats(self) -> dict:
+        return {
+            "devices": sorted(self.devices) if self.devices is not None else None,
+            "sensors": [SENSORS[i] for i in self._rows],
+            "max_hz": self.max_hz,
+            "deadband": self.deadband,
+            "filtered_device": self.filtered_device,
+            "filtered_rate": self.filtered_rate,
+            "filtered_deadband": self.filtered_deadband,
+        }